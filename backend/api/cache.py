@@ -0,0 +1,220 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from api.constants import RECIPE_CACHE_TIMEOUT
+
+PREFIX = 'recipes'
+
+# Поколения, от которых зависят закешированные ответы. Любое изменение
+# данных меняет значение соответствующего ключа, и записи, сохранённые
+# со старым значением, перестают считаться актуальными.
+CATALOGUE = f'{PREFIX}:gen:catalogue'
+LIST = f'{PREFIX}:gen:list'
+INGREDIENTS = f'{PREFIX}:gen:ingredients'
+SHOPPING_LISTS = f'{PREFIX}:gen:shopping-lists'
+SEARCH = f'{PREFIX}:gen:search'
+RECIPE_INGREDIENTS = f'{PREFIX}:gen:recipe-ingredients'
+RANKING = f'{PREFIX}:gen:ranking'
+RECIPE_EDITS = f'{PREFIX}:gen:recipe-edits'
+
+# Поколения, которые меняются вместе с порядком выдачи в сортировке:
+# рейтинги переписывает пересчёт, а время приготовления — любая правка
+# рецепта, даже если его нет на закешированной странице.
+ORDERING_GENERATIONS = {
+    'popular': RANKING,
+    'trending': RANKING,
+    'cooking_time': RECIPE_EDITS,
+}
+
+
+def recipe_key(pk):
+    return f'{PREFIX}:gen:recipe:{pk}'
+
+
+def author_key(pk):
+    return f'{PREFIX}:gen:author:{pk}'
+
+
+def author_list_key(pk):
+    return f'{PREFIX}:gen:author-list:{pk}'
+
+
+def tag_list_key(slug):
+    return f'{PREFIX}:gen:tag-list:{slug}'
+
+
+def shopping_list_key(user_id):
+    return f'{PREFIX}:gen:shopping-list:{user_id}'
+
+
+def get_generations(keys):
+    """
+    Возвращает текущие значения поколений.
+
+    Отсутствующее (или вытесненное) поколение создаётся с новым значением,
+    поэтому старые записи с ним никогда не совпадут.
+    """
+    keys = list(keys)
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    for key in missing:
+        cache.add(key, time.time_ns(), None)
+    if missing:
+        generations.update(cache.get_many(missing))
+    return generations
+
+
+def bump_generations(keys):
+    """
+    Сдвигает поколения после фиксации текущей транзакции.
+    """
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(
+            {key: time.time_ns() for key in keys}, None))
+
+
+class VersionedSnapshot:
+    """
+    Данные, которые строятся один раз на воркер и перестраиваются только
+    при смене поколения version_key в общем кеше.
+
+    Поколение проверяется не чаще раза в check_interval секунд, так что
+    между проверками чтение вообще не обращается ни к кешу, ни к базе.
+    Первый раз данные строятся целиком (build), дальше — через update,
+    который наследник может сделать инкрементальным.
+    """
+
+    version_key = None
+    check_interval = 1
+
+    def __init__(self):
+        self.version = None
+        self.checked_at = 0
+
+    def build(self):
+        raise NotImplementedError
+
+    def update(self):
+        self.build()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        version = get_generations([self.version_key])[self.version_key]
+        if version != self.version:
+            if self.version is None:
+                self.build()
+            else:
+                self.update()
+            self.version = version
+
+
+def count(event):
+    key = f'{PREFIX}:stats:{event}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+def get_stats():
+    stats = cache.get_many([f'{PREFIX}:stats:hit', f'{PREFIX}:stats:miss'])
+    return {
+        'hit': stats.get(f'{PREFIX}:stats:hit', 0),
+        'miss': stats.get(f'{PREFIX}:stats:miss', 0),
+    }
+
+
+def reset_stats():
+    cache.delete_many([f'{PREFIX}:stats:hit', f'{PREFIX}:stats:miss'])
+
+
+class AnonymousCacheMixin:
+    """
+    Кеширует list и retrieve для анонимных пользователей.
+
+    Для анонимов флаги избранного и корзины всегда False, поэтому ответ
+    зависит только от параметров запроса. Ключ строится по полному URL,
+    а вместе с данными сохраняются поколения рецептов, авторов и выборок,
+    из которых собран ответ.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return super().list(request, *args, **kwargs)
+        scope = [CATALOGUE]
+        author = request.query_params.get('author')
+        tags = request.query_params.getlist('tags')
+        if author:
+            scope.append(author_list_key(author))
+        scope.extend(tag_list_key(slug) for slug in tags)
+        if not author and not tags:
+            scope.append(LIST)
+        if request.query_params.get('search'):
+            # Правка рецепта может добавить его в чужую выдачу поиска.
+            scope.append(SEARCH)
+        if 'ingredients' in request.query_params:
+            scope.append(RECIPE_INGREDIENTS)
+        ordering = request.query_params.get('ordering')
+        if ordering in ORDERING_GENERATIONS:
+            scope.append(ORDERING_GENERATIONS[ordering])
+        return self.cached_response(
+            request, scope,
+            lambda: super(AnonymousCacheMixin, self).list(
+                request, *args, **kwargs),
+            lambda data: data['results'],
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(
+            request, [CATALOGUE],
+            lambda: super(AnonymousCacheMixin, self).retrieve(
+                request, *args, **kwargs),
+            lambda data: [data],
+        )
+
+    @staticmethod
+    def cached_response(request, scope, build, get_items):
+        url = request.build_absolute_uri(request.path)
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        digest = hashlib.sha1(f'{url}?{params}'.encode()).hexdigest()
+        entry_key = f'{PREFIX}:response:{digest}'
+
+        entry = cache.get(entry_key)
+        if entry is not None:
+            if get_generations(entry['deps']) == entry['deps']:
+                count('hit')
+                response = Response(entry['data'])
+                response['X-Cache'] = 'HIT'
+                return response
+
+        count('miss')
+        generations = get_generations(scope)
+        response = build()
+        if response.status_code == 200:
+            deps = set(scope)
+            for item in get_items(response.data):
+                deps.add(recipe_key(item['id']))
+                deps.add(author_key(item['author']['id']))
+            generations.update(get_generations(deps - set(scope)))
+            cache.set(
+                entry_key,
+                {'deps': generations, 'data': response.data},
+                RECIPE_CACHE_TIMEOUT,
+            )
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import json
+
+from api.cache import CATALOGUE, VersionedSnapshot
+from api.serializers.recipes import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+
+class CatalogueSnapshot(VersionedSnapshot):
+    """
+    Каталог тегов и ингредиентов одним JSON-документом.
+
+    Тело сериализуется и сжимается один раз при смене версии каталога.
+    ETag считается от содержимого, поэтому совпадает у всех воркеров и
+    переживает перезапуски.
+    """
+
+    version_key = CATALOGUE
+
+    def __init__(self):
+        super().__init__()
+        self.body = b''
+        self.gzipped = b''
+        self.etag = ''
+
+    def build(self):
+        body = json.dumps(
+            {
+                'tags': TagSerializer(
+                    Tag.objects.order_by('id'), many=True).data,
+                'ingredients': IngredientSerializer(
+                    Ingredient.objects.order_by('id'), many=True).data,
+            },
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body, self.gzipped, self.etag = (
+            body, gzip.compress(body, compresslevel=9, mtime=0), digest)
+
+    def get(self):
+        self.refresh()
+        return self
+
+
+catalogue_snapshot = CatalogueSnapshot()
+
+
+class TagBits(VersionedSnapshot):
+    """
+    Соответствие slug тега его биту в Recipe.tags_mask.
+    """
+
+    version_key = CATALOGUE
+
+    def __init__(self):
+        super().__init__()
+        self.bits = {}
+
+    def build(self):
+        self.bits = dict(
+            Tag.objects.exclude(bit=None).values_list('slug', 'bit'))
+
+    def get(self):
+        self.refresh()
+        return self.bits
+
+    def choices(self):
+        return [(slug, slug) for slug in self.get()]
+
+    def mask(self, slugs):
+        bits = self.get()
+        return sum(1 << bits[slug] for slug in set(slugs))
+
+
+tag_bits = TagBits()
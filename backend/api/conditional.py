@@ -0,0 +1,83 @@
+import hashlib
+
+from django.db.models import prefetch_related_objects
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    ETag и Last-Modified для list и retrieve рецептов.
+
+    Карточка: валидатор — updated_at и флаги пользователя, их читает один
+    запрос по первичному ключу до сериализации. Список: валидатор — id,
+    updated_at и флаги рецептов страницы вместе со ссылками пагинации;
+    страница выбирается тем же запросом, что и для ответа, а предвыборка
+    тегов и ингредиентов и сериализация выполняются только без 304.
+    Last-Modified отдаётся только анонимам и только для карточки: у
+    страницы списка состав может смениться без изменения updated_at.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(
+            self.get_queryset().prefetch_related(None))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return super().list(request, *args, **kwargs)
+        envelope = self.get_paginated_response([]).data
+        validator = [
+            [(recipe.pk, recipe.updated_at, recipe.is_favorited,
+              recipe.is_in_shopping_cart, recipe.author_is_subscribed)
+             for recipe in page],
+            [(key, value) for key, value in envelope.items()
+             if key != 'results'],
+        ]
+
+        def build():
+            if request.user.is_anonymous:
+                # У анонимов ответ берётся из общего кеша, если он там есть.
+                return super(ConditionalGetMixin, self).list(
+                    request, *args, **kwargs)
+            prefetch_related_objects(page, *self.prefetch_lookups())
+            return self.get_paginated_response(
+                self.get_serializer(page, many=True).data)
+
+        return self.conditional_response(request, validator, None, build)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        row = (
+            self.get_queryset().prefetch_related(None)
+            .filter(**{self.lookup_field: lookup})
+            .values_list('updated_at', 'is_favorited', 'is_in_shopping_cart',
+                         'author_is_subscribed')
+            .first()
+        )
+        build = (lambda: super(ConditionalGetMixin, self).retrieve(
+            request, *args, **kwargs))
+        if row is None:
+            return build()
+        return self.conditional_response(request, row, row[0], build)
+
+    @staticmethod
+    def conditional_response(request, validator, last_modified, build):
+        etag = '"{}"'.format(hashlib.md5(
+            repr(validator).encode()).hexdigest())
+        anonymous = request.user.is_anonymous
+        last_modified = (
+            int(last_modified.timestamp())
+            if anonymous and last_modified else None
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = build()
+        if response.status_code not in (200, 304):
+            return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = (
+            'no-cache' if anonymous else 'private, no-cache')
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -2,3 +2,95 @@ PAGE_SIZE = 10
 
 MIN_VALUE = 1
 MAX_VALUE = 32_000
+
+RECIPE_CACHE_TIMEOUT = 60 * 60
+
+INGREDIENT_SEARCH_LIMIT = 50
+INGREDIENT_INDEX_CHECK_INTERVAL = 1
+
+# Конфигурация полнотекстового поиска PostgreSQL и веса bm25 колонок
+# индекса SQLite (название, ингредиенты, описание).
+RECIPE_SEARCH_CONFIG = 'russian'
+RECIPE_SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+RECIPE_SEARCH_BATCH_SIZE = 500
+
+# Поиск рецептов по набору ингредиентов (?ingredients=1,5,9&match=all).
+INGREDIENT_MATCH_MODES = ('all', 'any', 'most')
+INGREDIENT_MATCH_MAX_IDS = 20
+RECIPE_INGREDIENT_INDEX_CHECK_INTERVAL = 1
+# Рецепты, изменённые за столько секунд до прошлой синхронизации индекса,
+# перечитываются снова: транзакция фиксируется позже, чем ставит
+# updated_at.
+RECIPE_INGREDIENT_INDEX_SYNC_MARGIN = 60
+RECIPE_INGREDIENT_INDEX_MAX_CHANGES = 5000
+# До стольких id выдача сужается фильтрами через pk IN (...), больше —
+# сравнением со всеми id отфильтрованного queryset.
+ORDERED_ID_FILTER_LIMIT = 10000
+
+# Рецепты автора, у которого столько подписчиков или больше, не
+# рассылаются по лентам, а подмешиваются при чтении.
+FEED_FAN_OUT_LIMIT = 10_000
+
+# Похожие рецепты: сколько соседей хранить, вес тега относительно
+# ингредиента, строк матрицы в блоке и строк таблицы в пакете записи.
+SIMILAR_RECIPES_COUNT = 10
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_BLOCK_SIZE = 256
+SIMILAR_WRITE_BATCH_SIZE = 5000
+
+SHOPPING_LIST_CHUNK_SIZE = 500
+SHOPPING_LIST_CACHE_TIMEOUT = 24 * 60 * 60
+SHOPPING_LIST_CACHE_MAX_SIZE = 1024 * 1024
+
+BULK_MAX_IDS = 100
+BULK_CREATED = 'created'
+BULK_EXISTS = 'exists'
+BULK_DELETED = 'deleted'
+BULK_ABSENT = 'absent'
+BULK_NOT_FOUND = 'not_found'
+BULK_SELF = 'self'
+
+# Наибольшая сторона вариантов изображения в пикселях.
+IMAGE_VARIANTS = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+IMAGE_FORMATS = {
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+IMAGE_JPEG_QUALITY = 82
+IMAGE_WEBP_QUALITY = 80
+
+# Ограничения загружаемых изображений: проверяются по заголовку файла.
+IMAGE_UPLOAD_FORMATS = ('JPEG', 'PNG')
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_SIDE = 8000
+IMAGE_MAX_PIXELS = 40_000_000
+BASE64_CHUNK_SIZE = 64 * 1024
+
+# Сортировки списка рецептов (?ordering=) и поля их ключа; у каждой есть
+# составной индекс в Recipe.Meta.indexes.
+RECIPE_ORDERINGS = {
+    'popular': ('-popularity', '-id'),
+    'trending': ('-trending', '-id'),
+    'cooking_time': ('cooking_time', '-id'),
+}
+# Рейтинги рецептов по добавлениям в избранное и корзину: поле рецепта,
+# период полураспада (с) и глубина истории (с). Старше глубины активность
+# в рейтинг не входит. Добавления группируются по часам (точность Trunc).
+RECIPE_SCORES = {
+    'popularity': (30 * 24 * 60 * 60, 365 * 24 * 60 * 60),
+    'trending': (24 * 60 * 60, 7 * 24 * 60 * 60),
+}
+RECIPE_SCORE_BUCKET = 'hour'
+FAVORITE_SCORE_WEIGHT = 1.0
+CART_SCORE_WEIGHT = 0.5
+RECIPE_SCORE_BATCH_SIZE = 1000
+
+# Короткие ссылки: кодов в LRU-кеше воркера и когда сбрасывать накопленные
+# переходы в базу — по числу переходов или по времени (с).
+SHORT_LINK_CACHE_SIZE = 10_000
+SHORT_LINK_FLUSH_CLICKS = 100
+SHORT_LINK_FLUSH_INTERVAL = 60
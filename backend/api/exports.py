@@ -0,0 +1,182 @@
+import csv
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from api.cache import (PREFIX, SHOPPING_LISTS, get_generations,
+                       shopping_list_key)
+from api.constants import (SHOPPING_LIST_CACHE_MAX_SIZE,
+                           SHOPPING_LIST_CACHE_TIMEOUT)
+from api.services import shopping_list_batches
+
+
+class ShoppingListExport:
+    """
+    Формат выгрузки списка покупок.
+
+    chunks() отдаёт файл кусками байтов по мере чтения строк списка.
+    """
+
+    extension = None
+    content_type = None
+
+    def chunks(self, user):
+        raise NotImplementedError
+
+
+class TextExport(ShoppingListExport):
+    extension = 'txt'
+    content_type = 'text/plain'
+
+    def chunks(self, user):
+        yield f"Список покупок для: {user.username}\n\n".encode()
+        empty = True
+        for batch in shopping_list_batches(user):
+            empty = False
+            yield "".join(
+                f"{name} ({unit}) — {total}\n" for name, unit, total in batch
+            ).encode()
+        if empty:
+            yield "Корзина пуста.\n".encode()
+
+
+class CsvExport(ShoppingListExport):
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def chunks(self, user):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+        for batch in shopping_list_batches(user):
+            writer.writerows(batch)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+
+class PdfExport(ShoppingListExport):
+    """
+    PDF со встроенным TTF-шрифтом с кириллицей (SHOPPING_LIST_PDF_FONT).
+
+    Документ собирается целиком в памяти и отдаётся одним куском; режим
+    invariant убирает из файла дату создания, так что одинаковый список
+    даёт одинаковые байты.
+    """
+
+    extension = 'pdf'
+    content_type = 'application/pdf'
+    font_name = 'ShoppingListFont'
+    font_size = 11
+    margin = 50
+
+    def register_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT))
+
+    def chunks(self, user):
+        self.register_font()
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4, invariant=True)
+        pdf.setTitle(f'Список покупок для: {user.username}')
+        width, height = A4
+        line_height = self.font_size * 1.5
+        y = height - self.margin
+
+        def write(text, size=self.font_size):
+            nonlocal y
+            if y < self.margin:
+                pdf.showPage()
+                y = height - self.margin
+            pdf.setFont(self.font_name, size)
+            pdf.drawString(self.margin, y, text)
+            y -= line_height
+
+        write(f'Список покупок для: {user.username}', self.font_size + 3)
+        y -= line_height
+        empty = True
+        for batch in shopping_list_batches(user):
+            empty = False
+            for name, unit, total in batch:
+                write(f'{name} ({unit}) — {total}')
+        if empty:
+            write('Корзина пуста.')
+        pdf.save()
+        yield buffer.getvalue()
+
+
+EXPORTS = {
+    export.extension: export
+    for export in (TextExport(), CsvExport(), PdfExport())
+}
+
+
+def export_key(user, export):
+    """
+    Ключ готового файла: меняется вместе с версией списка покупок.
+
+    Версия пользователя сдвигается при любом изменении его сумм (корзина,
+    состав рецептов в ней), общая — при пересборке списков и изменении
+    ингредиентов. Имя пользователя входит в заголовок файла.
+    """
+    generations = get_generations(
+        [SHOPPING_LISTS, shopping_list_key(user.pk)])
+    digest = hashlib.sha1(repr((
+        sorted(generations.items()), user.username, export.extension,
+    )).encode()).hexdigest()
+    return f'{PREFIX}:shopping-list:{user.pk}:{digest}'
+
+
+def cache_chunks(key, chunks):
+    """
+    Пропускает куски файла дальше и сохраняет его в кеш, если он не больше
+    SHOPPING_LIST_CACHE_MAX_SIZE.
+    """
+    stored, size = [], 0
+    for chunk in chunks:
+        if stored is not None:
+            size += len(chunk)
+            if size > SHOPPING_LIST_CACHE_MAX_SIZE:
+                stored = None
+            else:
+                stored.append(chunk)
+        yield chunk
+    if stored is not None:
+        cache.set(key, b''.join(stored), SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def shopping_list_response(user, export_format='txt', compress=False):
+    """
+    Возвращает потоковый ответ с файлом списка покупок.
+
+    Повторная выгрузка той же версии списка берётся из кеша без запросов
+    к базе. При compress тело сжимается gzip на лету.
+    """
+    export = EXPORTS[export_format]
+    key = export_key(user, export)
+    content = cache.get(key)
+    chunks = (iter([content]) if content is not None
+              else cache_chunks(key, export.chunks(user)))
+    if compress:
+        chunks = compress_sequence(chunks)
+    response = StreamingHttpResponse(chunks, content_type=export.content_type)
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = (
+        f"attachment; filename={user.username}_shopping_cart."
+        f"{export.extension}")
+    response["X-Cache"] = "HIT" if content is not None else "MISS"
+    return response
@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model
 from django_filters import rest_framework as filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag
+from api.catalogue import tag_bits
+from api.constants import RECIPE_ORDERINGS
+from api.search import recipe_search
+from api.services import with_any_tag
+from recipes.models import Recipe
 
 User = get_user_model()
 
@@ -15,12 +18,17 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_bits.choices,
+        method='filter_tags',
     )
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
+    search = filters.CharFilter(method='filter_search')
+    # Последним: явная сортировка заменяет порядок релевантности поиска.
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
@@ -29,8 +37,16 @@ class RecipeFilter(filters.FilterSet):
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
+            'ordering',
         )
 
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов: одна проверка маски без JOIN.
+        """
+        return with_any_tag(queryset, tag_bits.mask(value))
+
     def filter_is_favorited(self, queryset, name, value):
         """
         Фильтрует рецепты по наличию в избранном у пользователя.
@@ -53,9 +69,17 @@ class RecipeFilter(filters.FilterSet):
             return queryset.filter(shopping_cart__user=user)
         return queryset.exclude(shopping_cart__user=user)
 
+    def filter_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск: подходящие рецепты, самые релевантные первыми.
+        """
+        if not value.strip():
+            return queryset
+        return recipe_search().filter(queryset, value)
 
-class IngredientSearchFilter(SearchFilter):
-    """
-    Поиск ингредиентов.
-    """
-    search_param = 'name'
+    def filter_ordering(self, queryset, name, value):
+        """
+        Сортирует по готовому рейтингу или времени приготовления — по
+        составному индексу, без агрегации при запросе.
+        """
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
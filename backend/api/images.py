@@ -0,0 +1,201 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from api.cache import author_key, bump_generations, recipe_key
+from api.constants import (IMAGE_FORMATS, IMAGE_JPEG_QUALITY, IMAGE_VARIANTS,
+                           IMAGE_WEBP_QUALITY)
+from api.storage import ContentAddressedStorage
+from recipes.models import Recipe
+from recipes.signals import touch_recipes
+
+User = get_user_model()
+
+# Модели и поля изображений, для которых собираются варианты.
+IMAGE_FIELDS = (
+    (Recipe, 'image'),
+    (User, 'avatar'),
+)
+
+_executor = None
+
+
+def variant_root(name):
+    """
+    Каталог вариантов файла: recipes/ab/ab12.png -> variants/recipes.
+
+    Имена вариантов — хеши их содержимого, поэтому отдельный каталог на
+    исходный файл не нужен.
+    """
+    return os.path.join('variants', name.split('/', 1)[0])
+
+
+def variant_files(variants):
+    """
+    Имена всех файлов вариантов из поля *_variants.
+    """
+    for variant in variants.values():
+        for fmt in IMAGE_FORMATS:
+            if fmt in variant:
+                yield variant[fmt]
+
+
+def render_variants(source, media_root, root):
+    """
+    Строит уменьшенные копии изображения: прогрессивный JPEG и WebP.
+
+    Выполняется в процессе пула, поэтому работает только с путями, Pillow
+    и файловым хранилищем, без базы. Каждый вариант сохраняется через
+    ContentAddressedStorage: имя — хеш его байтов, файл пишется во
+    временный и атомарно переименовывается. Поэтому пересборка или
+    повторная загрузка того же изображения не меняет файл, который
+    клиенты уже закешировали навсегда, и читатели не видят недописанный
+    файл. Изображение не увеличивается: если оно меньше варианта, вариант
+    получает исходный размер. WebP пропускается, если Pillow собран без
+    него.
+    """
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    if has_alpha:
+        # У JPEG нет прозрачности: фон заливается белым.
+        flat = Image.new('RGB', image.size, 'white')
+        flat.paste(image, mask=image.getchannel('A'))
+    else:
+        flat = image
+    encoders = {
+        'jpg': (flat, 'JPEG', {'quality': IMAGE_JPEG_QUALITY,
+                               'optimize': True, 'progressive': True}),
+    }
+    if features.check('webp'):
+        encoders['webp'] = (image, 'WEBP', {'quality': IMAGE_WEBP_QUALITY,
+                                            'method': 4})
+
+    storage = ContentAddressedStorage(location=media_root)
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        width, height = flat.size
+        scale = min(1, size / max(width, height))
+        dimensions = (max(1, round(width * scale)),
+                      max(1, round(height * scale)))
+        variants[variant] = {'width': dimensions[0],
+                             'height': dimensions[1]}
+        for fmt, (original, encoder, params) in encoders.items():
+            buffer = io.BytesIO()
+            original.resize(dimensions, Image.LANCZOS).save(
+                buffer, encoder, **params)
+            variants[variant][fmt] = storage.save(
+                os.path.join(root, f'{variant}.{fmt}'),
+                ContentFile(buffer.getvalue()))
+    return variants
+
+
+def variants_executor():
+    """
+    Пул процессов для сборки вариантов, один на воркер приложения.
+
+    Создаётся при первой загрузке, так что процессы пула появляются уже
+    после форка воркера.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS)
+    return _executor
+
+
+def store_variants(model, pk, field, name, variants):
+    """
+    Сохраняет варианты, если у объекта всё ещё то же изображение.
+
+    Пока загрузка обрабатывалась, изображение могли заменить: тогда
+    варианты устарели и не записываются.
+    """
+    # Ссылки на изображения входят в ответы с рецептами: их ETag и
+    # закешированные копии должны смениться.
+    changes = {f'{field}_variants': variants}
+    if model is Recipe:
+        changes['updated_at'] = timezone.now()
+    if not model.objects.filter(pk=pk, **{field: name}).update(**changes):
+        return
+    if model is Recipe:
+        bump_generations([recipe_key(pk)])
+    else:
+        touch_recipes(Recipe.objects.filter(author_id=pk))
+        bump_generations([author_key(pk)])
+
+
+def stored(model, pk, field, name, future):
+    """
+    Колбэк пула: выполняется в служебном потоке, поэтому сам закрывает
+    своё соединение с базой.
+    """
+    if future.exception() is not None:
+        # Варианты не собрались (например, повреждённый файл): клиенты
+        # получают оригинал, а build_image_variants попробует снова.
+        return
+    try:
+        store_variants(model, pk, field, name, future.result())
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(instance, field):
+    """
+    Ставит сборку вариантов изображения в пул после фиксации транзакции.
+
+    При IMAGE_VARIANT_WORKERS = 0 варианты собираются сразу, в том же
+    процессе (для разработки и тестов).
+    """
+    name = getattr(instance, field).name
+    if not name:
+        return
+    model, pk = type(instance), instance.pk
+    args = (default_storage.path(name), settings.MEDIA_ROOT,
+            variant_root(name))
+
+    def submit():
+        if not settings.IMAGE_VARIANT_WORKERS:
+            store_variants(model, pk, field, name, render_variants(*args))
+            return
+        future = variants_executor().submit(render_variants, *args)
+        future.add_done_callback(partial(stored, model, pk, field, name))
+
+    transaction.on_commit(submit)
+
+
+def variant_url(name, request=None):
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def srcset(variants, request=None):
+    """
+    Значения srcset по типам: {'image/webp': 'url 160w, url 480w', ...}.
+
+    Варианты одной ширины (у небольших изображений) выводятся один раз.
+    """
+    by_width = {}
+    for variant in sorted(variants.values(), key=itemgetter('width')):
+        by_width.setdefault(variant['width'], variant)
+    if not by_width:
+        return {}
+    return {
+        content_type: ', '.join(
+            f'{variant_url(variant[fmt], request)} {width}w'
+            for width, variant in by_width.items()
+        )
+        for fmt, content_type in IMAGE_FORMATS.items()
+        if all(fmt in variant for variant in by_width.values())
+    }
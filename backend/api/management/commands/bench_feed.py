@@ -0,0 +1,143 @@
+import io
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.feed import Feed
+from api.pagination import FeedPagination, KeysetPagination
+from recipes.models import Recipe
+from users.models import Subscription, User
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-feed',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает ленту подписок из таблицы лент с выборкой рецептов по "
+        "подпискам через JOIN: совпадение страниц и время их чтения"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=20_000,
+                            help='Количество рецептов')
+        parser.add_argument('--users', type=int, default=2_000,
+                            help='Количество пользователей')
+        parser.add_argument('--subscriptions', type=float, default=50,
+                            help='Среднее число подписок у пользователя')
+        parser.add_argument('--readers', type=int, default=5,
+                            help='Читателей с наибольшим числом подписок')
+        parser.add_argument('--pages', type=int, default=5,
+                            help='Страниц ленты подряд по курсору')
+        parser.add_argument('--page-size', type=int, default=6,
+                            help='Размер страницы')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                started = time.perf_counter()
+                call_command(
+                    'seed_load_data',
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    seed=options['seed'],
+                    favorites=0,
+                    carts=0,
+                    subscriptions=options['subscriptions'],
+                    stdout=io.StringIO(),
+                )
+                self.stdout.write(
+                    f'Данные и ленты: '
+                    f'{time.perf_counter() - started:.1f} с, '
+                    f'рецептов с чтением напрямую: '
+                    f'{Recipe.objects.filter(fan_out_on_read=True).count()}')
+                results, mismatched = self.measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'читатель':>9} {'подписок':>9} {'лента':<8} "
+            f"{'p50, мс':>9} {'p95, мс':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['reader']:>9} {result['subscriptions']:>9} "
+                f"{result['feed']:<8} {result['p50']:>9.1f} "
+                f"{result['p95']:>9.1f}")
+        if mismatched:
+            raise CommandError(
+                f'Лента расходится с JOIN у читателей: {mismatched}')
+        self.stdout.write(self.style.SUCCESS('Лента совпадает с JOIN'))
+
+    def measure(self, options):
+        readers = (
+            User.objects.annotate(subscriptions=Count('follower'))
+            .order_by('-subscriptions', 'id')
+            .values_list('pk', 'subscriptions')[:options['readers']]
+        )
+        results, mismatched = [], []
+        for pk, subscriptions in readers:
+            user = User.objects.get(pk=pk)
+            feeds = {
+                'таблица': (FeedPagination,
+                            lambda: Feed(user, Recipe.objects.all())),
+                'join': (KeysetPagination, lambda: Recipe.objects.filter(
+                    author__in=Subscription.objects.filter(
+                        user=user).values('author'))),
+            }
+            pages = {}
+            for name, (pagination, source) in feeds.items():
+                ids, samples = self.walk(pagination, source, options)
+                pages[name] = ids
+                samples.sort()
+                results.append({
+                    'reader': pk,
+                    'subscriptions': subscriptions,
+                    'feed': name,
+                    'p50': statistics.median(samples),
+                    'p95': samples[min(len(samples) - 1,
+                                       int(len(samples) * 0.95))],
+                })
+            if pages['таблица'] != pages['join']:
+                mismatched.append(pk)
+        return results, mismatched
+
+    @staticmethod
+    def walk(pagination, source, options):
+        """
+        Листает ленту по курсору и возвращает id рецептов и время страниц.
+        """
+        factory = APIRequestFactory()
+        ids, samples = [], []
+        params = {'cursor': '', 'limit': options['page_size']}
+        for _ in range(options['pages']):
+            request = Request(factory.get('/', params))
+            paginator = pagination()
+            started = time.perf_counter()
+            page = paginator.paginate_queryset(source(), request)
+            samples.append((time.perf_counter() - started) * 1000)
+            ids += [recipe.pk for recipe in page]
+            if not page or not paginator.has_next:
+                break
+            params['cursor'] = paginator.encode_cursor(
+                [paginator.serialize_value(getattr(page[-1], attname))
+                 for attname in paginator.attnames], False)
+        return ids, samples
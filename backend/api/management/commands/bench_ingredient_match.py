@@ -0,0 +1,154 @@
+import io
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.search import RecipeIngredientIndex
+from recipes.models import Ingredient, RecipeIngredient
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-ingredient-match',
+    }
+}
+
+
+def sql_match(ingredient_ids, required):
+    """
+    Тот же поиск через GROUP BY по связям рецептов с ингредиентами.
+    """
+    return list(
+        RecipeIngredient.objects.filter(ingredient_id__in=ingredient_ids)
+        .values('recipe_id').annotate(hits=Count('pk'))
+        .filter(hits__gte=required)
+        .order_by('-hits', '-recipe__pub_date', '-recipe_id')
+        .values_list('recipe_id', flat=True)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает поиск рецептов по набору ингредиентов через индекс в "
+        "памяти и через SQL: время, память индекса и совпадение выдачи"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1_000_000,
+                            help='Количество рецептов')
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Количество пользователей')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Прогонов каждого запроса')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                call_command(
+                    'seed_load_data',
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    seed=options['seed'],
+                    favorites=0,
+                    carts=0,
+                    subscriptions=0,
+                    stdout=io.StringIO(),
+                )
+                index = RecipeIngredientIndex()
+                started = time.perf_counter()
+                index.refresh()
+                build_seconds = time.perf_counter() - started
+                arrays = [index.keys, *index.postings.values()]
+                links = sum(map(len, arrays)) - len(index.keys)
+                size = sum(len(keys) * keys.itemsize for keys in arrays)
+                self.stdout.write(
+                    f'Индекс: {links} связей за {build_seconds:.1f} с, '
+                    f'массивы {size / 2 ** 20:.1f} МБ')
+                results = [
+                    self.measure(index, ingredient_ids, match, options)
+                    for ingredient_ids, match in self.queries()
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'ингредиенты':<24} {'match':<6} {'найдено':>9} "
+            f"{'индекс p50':>11} {'p95':>7} {'SQL p50':>9} {'p95':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['ingredients']:<24} {result['match']:<6} "
+                f"{result['count']:>9} {result['index_p50']:>11.1f} "
+                f"{result['index_p95']:>7.1f} {result['sql_p50']:>9.1f} "
+                f"{result['sql_p95']:>7.1f}")
+        mismatched = [
+            f"{result['ingredients']} {result['match']}"
+            for result in results if not result['identical']
+        ]
+        if mismatched:
+            raise CommandError(f'Выдача индекса отличается от SQL: '
+                               f'{mismatched}')
+        self.stdout.write(self.style.SUCCESS('Выдача индекса совпадает с SQL'))
+
+    @staticmethod
+    def queries():
+        """
+        Наборы из частых, средних и редких ингредиентов во всех режимах.
+        """
+        ingredients = list(
+            Ingredient.objects.annotate(used=Count('recipes'))
+            .filter(used__gt=0).order_by('-used', 'id')
+            .values_list('id', flat=True)
+        )
+        if len(ingredients) < 3:
+            raise CommandError('В наборе слишком мало ингредиентов')
+        middle = len(ingredients) // 2
+        sets = (
+            ingredients[:3],
+            ingredients[middle:middle + 3],
+            [ingredients[0], ingredients[middle], ingredients[-1]],
+            ingredients[:6],
+        )
+        return [(ingredient_ids, match)
+                for ingredient_ids in sets
+                for match in ('all', 'most', 'any')]
+
+    @staticmethod
+    def measure(index, ingredient_ids, match, options):
+        required = {
+            'all': len(ingredient_ids),
+            'any': 1,
+            'most': len(ingredient_ids) // 2 + 1,
+        }[match]
+        timings = {'index': [], 'sql': []}
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            found = index.match(ingredient_ids, match)
+            timings['index'].append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            expected = sql_match(ingredient_ids, required)
+            timings['sql'].append((time.perf_counter() - started) * 1000)
+        result = {
+            'ingredients': ','.join(map(str, ingredient_ids)),
+            'match': match,
+            'count': len(found),
+            'identical': found == expected,
+        }
+        for name, samples in timings.items():
+            samples.sort()
+            result[f'{name}_p50'] = statistics.median(samples)
+            result[f'{name}_p95'] = samples[min(len(samples) - 1,
+                                                int(len(samples) * 0.95))]
+        return result
@@ -0,0 +1,140 @@
+import io
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.constants import RECIPE_ORDERINGS
+from api.pagination import KeysetPagination
+from api.ranking import update_recipe_scores
+from recipes.management.commands.seed_load_data import SEED_EPOCH
+from recipes.models import Recipe
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-recipe-ordering',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает страницы списка рецептов в сортировках по рейтингу и "
+        "времени приготовления с сортировкой по умолчанию и с подсчётом "
+        "избранного при запросе; проверяет, что курсор не теряет и не "
+        "повторяет рецепты"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000,
+                            help='Количество рецептов')
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Количество пользователей')
+        parser.add_argument('--pages', type=int, default=20,
+                            help='Страниц подряд по курсору')
+        parser.add_argument('--page-size', type=int, default=6,
+                            help='Размер страницы')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                call_command(
+                    'seed_load_data',
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    seed=options['seed'],
+                    subscriptions=0,
+                    stdout=io.StringIO(),
+                )
+                started = time.perf_counter()
+                changed = update_recipe_scores(
+                    SEED_EPOCH + timedelta(hours=1))
+                self.stdout.write(
+                    f'Пересчёт рейтингов: '
+                    f'{time.perf_counter() - started:.1f} с, '
+                    f'изменено {changed} рецептов')
+                results = self.measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'сортировка':<14} {'страниц':>8} {'p50, мс':>9} "
+            f"{'p95, мс':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['ordering']:<14} {result['pages']:>8} "
+                f"{result['p50']:>9.1f} {result['p95']:>9.1f}")
+        self.stdout.write(self.style.SUCCESS(
+            'Курсор обходит все сортировки без пропусков и повторов'))
+
+    def measure(self, options):
+        orderings = {'pub_date': ('-pub_date', '-id'), **RECIPE_ORDERINGS}
+        results = []
+        for name, ordering in orderings.items():
+            samples = self.walk(ordering, options)
+            results.append(dict(ordering=name, **self.summary(samples)))
+        # Та же глубина с подсчётом избранного при каждом запросе.
+        counted = Recipe.objects.annotate(
+            favorites=Count('favorite')).order_by('-favorites', '-id')
+        samples = []
+        for page in range(options['pages']):
+            offset = page * options['page_size']
+            started = time.perf_counter()
+            list(counted[offset:offset + options['page_size']])
+            samples.append((time.perf_counter() - started) * 1000)
+        results.append(dict(ordering='count', **self.summary(samples)))
+        return results
+
+    def walk(self, ordering, options):
+        """
+        Листает список по курсору, сверяя страницы с выборкой через OFFSET.
+        """
+        factory = APIRequestFactory()
+        queryset = Recipe.objects.select_related('author')
+        expected = list(queryset.order_by(*ordering).values_list(
+            'pk', flat=True)[:options['pages'] * options['page_size']])
+        view = type('View', (), {'keyset_ordering': ordering})
+        ids, samples = [], []
+        params = {'cursor': '', 'limit': options['page_size']}
+        for _ in range(options['pages']):
+            paginator = KeysetPagination()
+            request = Request(factory.get('/', params))
+            started = time.perf_counter()
+            page = paginator.paginate_queryset(queryset, request, view)
+            samples.append((time.perf_counter() - started) * 1000)
+            ids += [recipe.pk for recipe in page]
+            if not page or not paginator.has_next:
+                break
+            params['cursor'] = paginator.encode_cursor(
+                [paginator.serialize_value(getattr(page[-1], attname))
+                 for attname in paginator.attnames], False)
+        if ids != expected:
+            raise CommandError(
+                f'Курсор расходится с OFFSET в сортировке {ordering}')
+        return samples
+
+    @staticmethod
+    def summary(samples):
+        samples = sorted(samples)
+        return {
+            'pages': len(samples),
+            'p50': statistics.median(samples),
+            'p95': samples[min(len(samples) - 1,
+                               int(len(samples) * 0.95))],
+        }
@@ -0,0 +1,158 @@
+import io
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.filters import RecipeFilter
+from api.search import RecipeSearch, recipe_search
+from recipes.models import Ingredient, Recipe, Tag
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-recipe-search',
+    }
+}
+
+# Признак того, что план запроса начинается с поискового индекса.
+INDEX_PLAN_MARKERS = {
+    'postgresql': '_search_document',
+    'sqlite': 'VIRTUAL TABLE INDEX',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет полнотекстовый поиск рецептов на синтетическом наборе: "
+        "первую страницу и число найденных, отдельно и вместе с фильтром "
+        "по тегу"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1_000_000,
+                            help='Количество рецептов')
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Количество пользователей')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Прогонов каждого запроса')
+        parser.add_argument('--page-size', type=int, default=6,
+                            help='Размер страницы')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных')
+        parser.add_argument('--baseline', action='store_true',
+                            help='Замерить и поиск подстрокой без индекса')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                started = time.perf_counter()
+                call_command(
+                    'seed_load_data',
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    seed=options['seed'],
+                    favorites=0,
+                    carts=0,
+                    subscriptions=0,
+                    stdout=io.StringIO(),
+                )
+                self.stdout.write(
+                    f'Данные и индекс: '
+                    f'{time.perf_counter() - started:.1f} с')
+                results, plans = self.measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'запрос':<32} {'поиск':<10} {'найдено':>9} "
+            f"{'p50, мс':>9} {'p95, мс':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['query']:<32} {result['search']:<10} "
+                f"{result['count']:>9} {result['p50']:>9.1f} "
+                f"{result['p95']:>9.1f}")
+        missed = [query for query, plan in plans.items()
+                  if INDEX_PLAN_MARKERS[connection.vendor] not in plan]
+        if missed:
+            raise CommandError(
+                f'Запросы выполняются без поискового индекса: {missed}')
+        self.stdout.write(self.style.SUCCESS('Поиск замерен'))
+
+    def queries(self):
+        """
+        Слова из названий частых, средних и редких ингредиентов.
+        """
+        ingredients = list(
+            Ingredient.objects.annotate(used=Count('recipes'))
+            .filter(used__gt=0).order_by('-used', 'id')
+            .values_list('name', flat=True)
+        )
+        if not ingredients:
+            raise CommandError('В наборе нет рецептов с ингредиентами')
+        picked = [ingredients[0], ingredients[len(ingredients) // 2],
+                  ingredients[-1]]
+        queries = [name.split()[0] for name in picked]
+        return queries + [f'{queries[0]} {queries[1]}', 'рецепт']
+
+    def measure(self, options):
+        searches = {'индекс': recipe_search()}
+        if options['baseline']:
+            searches['подстрока'] = RecipeSearch()
+        tag = Tag.objects.order_by('id').first()
+        results, plans = [], {}
+        for query in self.queries():
+            for data in ({'search': query},
+                         {'search': query, 'tags': [tag.slug]}):
+                label = ' + '.join(
+                    f'{key}={value}' if key == 'search' else key
+                    for key, value in data.items())
+                for name, search in searches.items():
+                    queryset = self.filtered(search, data)
+                    if name == 'индекс':
+                        plans[label] = queryset.explain()
+                    results.append(dict(
+                        query=label, search=name,
+                        **self.time(queryset, options)))
+        return results, plans
+
+    @staticmethod
+    def filtered(search, data):
+        """
+        Queryset списка рецептов с фильтрами, как во вьюсете.
+        """
+        filterset = RecipeFilter(data=data, queryset=Recipe.objects.all())
+        filterset.filter_search = (
+            lambda queryset, name, value: search.filter(queryset, value))
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors)
+        return filterset.qs.select_related('author')
+
+    @staticmethod
+    def time(queryset, options):
+        """
+        Время первой страницы вместе с подсчётом найденных.
+        """
+        samples = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            count = queryset.count()
+            list(queryset[:options['page_size']])
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return {
+            'count': count,
+            'p50': statistics.median(samples),
+            'p95': samples[min(len(samples) - 1,
+                               int(len(samples) * 0.95))],
+        }
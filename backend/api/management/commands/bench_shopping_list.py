@@ -0,0 +1,198 @@
+import gzip
+import io
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.constants import SHOPPING_LIST_CHUNK_SIZE
+from api.exports import EXPORTS, shopping_list_response
+from recipes.models import Ingredient, Recipe, RecipeIngredient, ShoppingCart
+
+User = get_user_model()
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-shopping-list',
+    }
+}
+
+
+def buffered_shopping_list(user):
+    """
+    Прежняя реализация: весь файл собирается в одну строку.
+
+    Нужна как эталон для сравнения байтов и памяти.
+    """
+    content = f"Список покупок для: {user.username}\n\n"
+
+    ingredients = (
+        RecipeIngredient.objects
+        .filter(recipe__shopping_cart__user=user)
+        .values("ingredient__name", "ingredient__measurement_unit")
+        .annotate(total=Sum("amount"))
+        .order_by("ingredient__name")
+    )
+
+    if not ingredients:
+        content += "Корзина пуста.\n"
+    else:
+        for item in ingredients:
+            name = item["ingredient__name"]
+            unit = item["ingredient__measurement_unit"]
+            total = item["total"]
+            content += f"{name} ({unit}) — {total}\n"
+    return content.encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает потребление памяти потоковой и буферизованной выгрузки "
+        "списка покупок на корзинах разного размера"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, nargs='+',
+                            default=[0, 100, 1000, 5000],
+                            help='Размеры корзин (число рецептов)')
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            default=10,
+                            help='Ингредиентов в каждом рецепте')
+        parser.add_argument('--max-growth', type=float, default=2.0,
+                            help='Допустимый рост пика памяти потоковой '
+                                 'выгрузки относительно наименьшей корзины')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                results = [
+                    self.measure(self.seed(size, index, options))
+                    for index, size in enumerate(options['carts'])
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'рецептов':>9} {'строк':>7} {'КиБ':>8} "
+            f"{'поток, КиБ':>11} {'буфер, КиБ':>11} {'мс':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['recipes']:>9} {result['lines']:>7} "
+                f"{result['size'] / 1024:>8.1f} "
+                f"{result['streaming_peak'] / 1024:>11.1f} "
+                f"{result['buffered_peak'] / 1024:>11.1f} "
+                f"{result['ms']:>7.1f}")
+
+        mismatched = [result['recipes'] for result in results
+                      if not result['identical']]
+        if mismatched:
+            raise CommandError(
+                f'Выгрузка отличается от эталона для корзин {mismatched}')
+        # Пока список меньше одной пачки, пик памяти растёт с ним вместе;
+        # стабильность проверяется на корзинах начиная с одной полной пачки.
+        peaks = [result['streaming_peak'] for result in results
+                 if result['lines'] > SHOPPING_LIST_CHUNK_SIZE]
+        if len(peaks) < 2:
+            raise CommandError(
+                'Нужно хотя бы две корзины больше одной пачки строк')
+        baseline, largest = min(peaks), max(peaks)
+        if largest > baseline * options['max_growth']:
+            raise CommandError(
+                f'Пик памяти вырос в {largest / baseline:.1f} раза')
+        self.stdout.write(self.style.SUCCESS(
+            f'Пик памяти потоковой выгрузки стабилен '
+            f'(рост {largest / baseline:.2f}×)'))
+
+    @staticmethod
+    def seed(size, index, options):
+        """
+        Создаёт пользователя с корзиной из size рецептов.
+
+        У каждого рецепта свои ингредиенты, поэтому число строк в списке
+        растёт вместе с корзиной.
+        """
+        per_recipe = options['ingredients_per_recipe']
+        user = User.objects.create(
+            email=f'cart{index}@example.com',
+            username=f'cart{index}',
+            first_name='Корзина',
+            last_name=str(size),
+            password=make_password(None),
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}-{number}',
+                       measurement_unit='г')
+            for number in range(size * per_recipe)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=user, name=f'Рецепт {number}', text='—',
+                   cooking_time=10, image='recipes/bench.png')
+            for number in range(size)
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            recipes = list(Recipe.objects.filter(author=user).order_by('id'))
+            ingredients = list(Ingredient.objects.filter(
+                name__startswith=f'Ингредиент {index}-').order_by('id'))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+            for number, recipe in enumerate(recipes)
+            for ingredient in ingredients[number * per_recipe:
+                                          (number + 1) * per_recipe]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe) for recipe in recipes)
+        call_command('rebuild_shopping_lists', user=[user.pk],
+                     stdout=io.StringIO())
+        return user
+
+    @staticmethod
+    def measure(user):
+        """
+        Замеряет пик памяти при выгрузке потоком и целиком.
+
+        Потоковая выгрузка замеряется без кеша готовых файлов: он хранит
+        файлы до SHOPPING_LIST_CACHE_MAX_SIZE и проверяется отдельно.
+        """
+        expected = buffered_shopping_list(user)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        size = lines = 0
+        for chunk in EXPORTS['txt'].chunks(user):
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+        elapsed = (time.perf_counter() - started) * 1000
+        streaming_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        buffered_shopping_list(user)
+        buffered_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Первая выгрузка строит файл, вторая (сжатая) берётся из кеша.
+        plain = b''.join(shopping_list_response(user).streaming_content)
+        compressed = gzip.decompress(b''.join(
+            shopping_list_response(user, compress=True).streaming_content))
+        return {
+            'recipes': user.shopping_cart.count(),
+            'lines': lines,
+            'size': size,
+            'streaming_peak': streaming_peak,
+            'buffered_peak': buffered_peak,
+            'ms': elapsed,
+            'identical': plain == compressed == expected,
+        }
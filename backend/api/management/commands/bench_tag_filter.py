@@ -0,0 +1,135 @@
+import io
+import itertools
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.catalogue import tag_bits
+from api.services import with_any_tag
+from recipes.models import Recipe, Tag
+
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench-tag-filter',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает фильтр рецептов по тегам через M2M-таблицу и по битовой "
+        "маске tags_mask: совпадение результатов и время первой страницы "
+        "с подсчётом"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1_000_000,
+                            help='Количество рецептов')
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Количество пользователей')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Прогонов каждого запроса')
+        parser.add_argument('--page-size', type=int, default=6,
+                            help='Размер страницы')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                started = time.perf_counter()
+                call_command(
+                    'seed_load_data',
+                    users=options['users'],
+                    recipes=options['recipes'],
+                    seed=options['seed'],
+                    favorites=0,
+                    carts=0,
+                    subscriptions=0,
+                    stdout=io.StringIO(),
+                )
+                self.stdout.write(
+                    f'Данные и маски: '
+                    f'{time.perf_counter() - started:.1f} с')
+                results, mismatched = self.measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'теги':<32} {'фильтр':<8} {'найдено':>9} "
+            f"{'p50, мс':>9} {'p95, мс':>9}")
+        for result in results:
+            self.stdout.write(
+                f"{result['tags']:<32} {result['filter']:<8} "
+                f"{result['count']:>9} {result['p50']:>9.1f} "
+                f"{result['p95']:>9.1f}")
+        if mismatched:
+            raise CommandError(
+                f'Фильтр по маске расходится с JOIN: {mismatched}')
+        self.stdout.write(self.style.SUCCESS(
+            'Фильтр по маске совпадает с JOIN'))
+
+    @staticmethod
+    def tag_sets():
+        """
+        Каждый тег по одному, все пары и все теги сразу.
+        """
+        slugs = list(Tag.objects.order_by('id').values_list('slug', flat=True))
+        if not slugs:
+            raise CommandError('В наборе нет тегов')
+        sets = [[slug] for slug in slugs]
+        sets += [list(pair) for pair in itertools.combinations(slugs, 2)]
+        if len(slugs) > 2:
+            sets.append(slugs)
+        return sets
+
+    def measure(self, options):
+        results, mismatched = [], []
+        for slugs in self.tag_sets():
+            label = ','.join(slugs)
+            filtered = {
+                'join': Recipe.objects.filter(
+                    tags__slug__in=slugs).distinct(),
+                'маска': with_any_tag(
+                    Recipe.objects.all(), tag_bits.mask(slugs)),
+            }
+            pages = {}
+            for name, queryset in filtered.items():
+                queryset = queryset.select_related('author')
+                result = self.time(queryset, options)
+                pages[name] = (result.pop('ids'), result['count'])
+                results.append(dict(tags=label, filter=name, **result))
+            if pages['join'] != pages['маска']:
+                mismatched.append(label)
+        return results, mismatched
+
+    @staticmethod
+    def time(queryset, options):
+        """
+        Время первой страницы вместе с подсчётом найденных.
+        """
+        samples = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            count = queryset.count()
+            page = list(queryset[:options['page_size']])
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        return {
+            'ids': [recipe.pk for recipe in page],
+            'count': count,
+            'p50': statistics.median(samples),
+            'p95': samples[min(len(samples) - 1,
+                               int(len(samples) * 0.95))],
+        }
@@ -0,0 +1,54 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from api.images import (IMAGE_FIELDS, render_variants, store_variants,
+                        variant_root)
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает варианты изображений рецептов и аватаров, у которых их '
+        'ещё нет (с --force — у всех)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Пересобрать и уже готовые варианты')
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_VARIANT_WORKERS or 1,
+                            help='Процессов для сборки')
+
+    def handle(self, *args, **options):
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for model, field in IMAGE_FIELDS:
+                images = model.objects.exclude(**{field: ''}).exclude(
+                    **{f'{field}__isnull': True})
+                if not options['force']:
+                    images = images.filter(**{f'{field}_variants': {}})
+                jobs = {
+                    pool.submit(render_variants, default_storage.path(name),
+                                settings.MEDIA_ROOT, variant_root(name)):
+                    (pk, name)
+                    for pk, name in images.values_list('pk', field).iterator()
+                }
+                built = 0
+                for job in as_completed(jobs):
+                    pk, name = jobs[job]
+                    try:
+                        variants = job.result()
+                    except (OSError, ValueError) as error:
+                        failed += 1
+                        self.stderr.write(
+                            f'{model._meta.model_name} {pk} ({name}): {error}')
+                        continue
+                    store_variants(model, pk, field, name, variants)
+                    built += 1
+                self.stdout.write(
+                    f'{model._meta.model_name}.{field}: собрано {built}')
+        if failed:
+            raise CommandError(f'Не удалось собрать варианты: {failed}')
+        self.stdout.write(self.style.SUCCESS('Варианты изображений собраны'))
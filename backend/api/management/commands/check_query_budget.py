@@ -0,0 +1,424 @@
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.search import recipe_ingredient_index
+from recipes import urls as recipes_urls
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.urls import recipes_router
+from users.models import Subscription
+from users.urls import users_router
+
+User = get_user_model()
+
+PNG_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+# Кеш в памяти процесса: обращения к DatabaseCache не должны попадать
+# в число SQL-запросов эндпоинтов.
+BUDGET_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+Endpoint = namedtuple(
+    'Endpoint',
+    'route method path status query_budget ms_budget paged data',
+)
+
+# Бюджеты задаются для авторизованного пользователя (force_authenticate,
+# без запроса за токеном). Для страничных эндпоинтов число запросов должно
+# совпадать на всех размерах страницы. Порядок важен: парные POST/DELETE
+# возвращают данные в исходное состояние, поэтому повторы независимы.
+ENDPOINTS = (
+    Endpoint('tags-list', 'get', '/api/tags/', 200, 1, 100, False, None),
+    Endpoint('tags-detail', 'get', '/api/tags/{tag}/', 200, 1, 100, False,
+             None),
+    Endpoint('ingredients-list', 'get', '/api/ingredients/?name={search}',
+             200, 1, 100, False, None),
+    Endpoint('ingredients-detail', 'get', '/api/ingredients/{ingredient}/',
+             200, 1, 100, False, None),
+    Endpoint('catalogue', 'get', '/api/catalogue/', 200, 2, 300, False,
+             None),
+    Endpoint('recipes-list', 'get', '/api/recipes/', 200, 6, 300, True,
+             None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?is_favorited=1', 200, 6,
+             300, True, None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?tags={tag_slug}', 200, 6,
+             300, True, None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?cursor=', 200, 5, 300,
+             True, None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?ordering=popular', 200,
+             6, 300, True, None),
+    Endpoint('recipes-list', 'get',
+             '/api/recipes/?ordering=popular&tags={tag_slug}', 200, 6, 300,
+             True, None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?ordering=trending&cursor=',
+             200, 5, 300, True, None),
+    Endpoint('recipes-list', 'get',
+             '/api/recipes/?ordering=cooking_time&cursor=', 200, 5, 300, True,
+             None),
+    Endpoint('recipes-list', 'get', '/api/recipes/?search={recipe_search}',
+             200, 6, 300, True, None),
+    Endpoint('recipes-list', 'get',
+             '/api/recipes/?search={recipe_search}&tags={tag_slug}', 200, 6,
+             300, True, None),
+    Endpoint('recipes-list', 'get',
+             '/api/recipes/?ingredients={recipe_ingredients}&match=any', 200,
+             5, 300, True, None),
+    Endpoint('recipes-list', 'get',
+             '/api/recipes/?ingredients={recipe_ingredients}&match=most'
+             '&tags={tag_slug}', 200, 5, 300, True, None),
+    Endpoint('recipes-detail', 'get', '/api/recipes/{recipe}/', 200, 4, 100,
+             False, None),
+    Endpoint('recipes-get-link', 'get', '/api/recipes/{recipe}/get-link/',
+             200, 4, 100, False, None),
+    Endpoint('recipes-similar', 'get', '/api/recipes/{recipe}/similar/',
+             200, 1, 100, False, None),
+    Endpoint('recipes-favorite', 'post', '/api/recipes/{recipe}/favorite/',
+             201, 4, 100, False, None),
+    Endpoint('recipes-favorite', 'delete',
+             '/api/recipes/{recipe}/favorite/', 204, 4, 100, False, None),
+    Endpoint('recipes-shopping-cart', 'post',
+             '/api/recipes/{recipe}/shopping_cart/', 201, 8, 100, False,
+             None),
+    Endpoint('recipes-shopping-cart', 'delete',
+             '/api/recipes/{recipe}/shopping_cart/', 204, 7, 100, False,
+             None),
+    Endpoint('recipes-feed', 'get', '/api/recipes/feed/?cursor=', 200, 5,
+             300, True, None),
+    Endpoint('recipes-feed', 'get', '/api/recipes/feed/?cursor=&count=1',
+             200, 7, 300, True, None),
+    Endpoint('recipes-bulk-favorite', 'post', '/api/recipes/bulk/favorite/',
+             200, 4, 100, False, 'bulk_recipes'),
+    Endpoint('recipes-bulk-favorite', 'delete',
+             '/api/recipes/bulk/favorite/', 200, 4, 100, False,
+             'bulk_recipes'),
+    Endpoint('recipes-bulk-shopping-cart', 'post',
+             '/api/recipes/bulk/shopping_cart/', 200, 8, 100, False,
+             'bulk_recipes'),
+    Endpoint('recipes-bulk-shopping-cart', 'delete',
+             '/api/recipes/bulk/shopping_cart/', 200, 7, 100, False,
+             'bulk_recipes'),
+    Endpoint('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', 200, 1, 300, False,
+             None),
+    Endpoint('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', 200, 1, 300,
+             False, None),
+    Endpoint('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/?format=pdf', 200, 1, 500,
+             False, None),
+    Endpoint('recipes-list', 'post', '/api/recipes/', 201, 29, 300, False,
+             'recipe'),
+    Endpoint('recipes-detail', 'patch', '/api/recipes/{created}/', 200, 28,
+             300, False, 'recipe'),
+    Endpoint('recipes-detail', 'delete', '/api/recipes/{created}/', 204, 17,
+             300, False, None),
+    Endpoint('users-list', 'get', '/api/users/', 200, 2, 300, True, None),
+    Endpoint('users-detail', 'get', '/api/users/{author}/', 200, 1, 100,
+             False, None),
+    Endpoint('users-me', 'get', '/api/users/me/', 200, 1, 100, False, None),
+    Endpoint('users-me-avatar', 'put', '/api/users/me/avatar/', 200, 5, 300,
+             False, 'avatar'),
+    Endpoint('users-me-avatar', 'delete', '/api/users/me/avatar/', 204, 2,
+             100, False, None),
+    Endpoint('users-subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', 200, 3, 300, True,
+             None),
+    Endpoint('users-bulk-subscribe', 'post', '/api/users/bulk/subscribe/',
+             200, 4, 100, False, 'bulk_authors'),
+    Endpoint('users-bulk-subscribe', 'delete', '/api/users/bulk/subscribe/',
+             200, 4, 100, False, 'bulk_authors'),
+    Endpoint('users-subscribe', 'post', '/api/users/{author}/subscribe/',
+             201, 5, 100, False, None),
+    Endpoint('users-subscribe', 'delete', '/api/users/{author}/subscribe/',
+             204, 4, 100, False, None),
+)
+
+# Маршруты, которые сознательно не замеряются.
+SKIPPED_ROUTES = {
+    'api-root': 'служебная страница DRF',
+    'users-set-password': 'время уходит на хеширование пароля',
+}
+
+# Эндпоинты с известной проблемой N+1: замеряются и попадают в отчёт,
+# но рост числа запросов с размером страницы не считается ошибкой.
+KNOWN_NOT_FLAT = set()
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет число SQL-запросов и время ответа эндпоинтов API "
+        "на тестовой базе с синтетическими данными"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=150,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes', type=int, default=400,
+                            help='Количество рецептов')
+        parser.add_argument('--page-sizes', type=int, nargs='+',
+                            default=[1, 6, 100],
+                            help='Размеры страниц для списков')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Количество прогонов каждого эндпоинта')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Зерно генератора данных')
+        parser.add_argument('--report', default='query_budget.json',
+                            help='Путь к JSON-отчёту')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Не удалять тестовую базу после прогона')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+            keepdb=options['keepdb'],
+        )
+        try:
+            # Варианты изображений собираются в самом запросе, поэтому
+            # бюджеты загрузок включают их сохранение.
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root,
+                                      CACHES=BUDGET_CACHES,
+                                      IMAGE_VARIANT_WORKERS=0):
+                fixtures = self.seed(options)
+                results = self.measure(fixtures, options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        uncovered = sorted(
+            self.registered_routes()
+            - {endpoint.route for endpoint in ENDPOINTS}
+            - set(SKIPPED_ROUTES)
+        )
+        failures = [item for item in results if item['status'] == 'fail']
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'dataset': {
+                'users': options['users'],
+                'recipes': options['recipes'],
+                'seed': options['seed'],
+            },
+            'page_sizes': options['page_sizes'],
+            'repeat': options['repeat'],
+            'results': results,
+            'uncovered_routes': uncovered,
+            'skipped_routes': SKIPPED_ROUTES,
+        }
+        with open(options['report'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        for item in results:
+            style = {
+                'ok': self.style.SUCCESS,
+                'known': self.style.WARNING,
+            }.get(item['status'], self.style.ERROR)
+            self.stdout.write(style(
+                f"{item['status']:5} {item['method'].upper():6} "
+                f"{item['path']} [limit={item['page_size']}] "
+                f"{item['queries']}/{item['query_budget']} запросов, "
+                f"{item['ms_median']:.1f}/{item['ms_budget']} мс"
+                + (f" — {item['reason']}" if item['reason'] else '')
+            ))
+        if uncovered:
+            failures.append(None)
+            self.stderr.write(self.style.ERROR(
+                f"Маршруты без бюджета: {', '.join(uncovered)}"))
+        self.stdout.write(f"Отчёт сохранён в {options['report']}")
+        if failures:
+            raise CommandError(
+                f"Бюджет превышен для {len(failures)} проверок")
+
+    @staticmethod
+    def registered_routes():
+        """
+        Возвращает имена маршрутов API: из роутеров и отдельных путей.
+        """
+        return {
+            url.name
+            for patterns in (recipes_router.urls, users_router.urls,
+                             recipes_urls.urlpatterns)
+            for url in patterns
+            if getattr(url, 'name', None)
+        }
+
+    def seed(self, options):
+        """
+        Наполняет тестовую базу детерминированным набором данных.
+        """
+        call_command(
+            'seed_load_data',
+            users=options['users'],
+            recipes=options['recipes'],
+            seed=options['seed'],
+            stdout=io.StringIO(),
+        )
+        rng = random.Random(options['seed'])
+        tags = list(Tag.objects.all())
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        user_ids = list(User.objects.values_list('id', flat=True))
+
+        viewer = User.objects.create(
+            email='viewer@example.com',
+            username='viewer',
+            first_name='Зритель',
+            last_name='Замеров',
+            password=make_password(None),
+        )
+        fixture_recipe = recipe_ids[0]
+        picked = recipe_ids[1:]
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=viewer, recipe_id=recipe_id)
+                for recipe_id in rng.sample(picked, min(30, len(picked)))
+            )
+        call_command('rebuild_shopping_lists', user=[viewer.pk],
+                     stdout=io.StringIO())
+        fixture_author = user_ids[-1]
+        Subscription.objects.bulk_create(
+            Subscription(user=viewer, author_id=author_id)
+            for author_id in user_ids[:-1][:110]
+        )
+        call_command('rebuild_feeds', user=[viewer.pk], stdout=io.StringIO())
+        call_command('build_similar_recipes', stdout=io.StringIO())
+
+        ingredient = Ingredient.objects.order_by('id').first()
+        recipe_ingredient = Ingredient.objects.filter(
+            recipes=fixture_recipe).order_by('id').first()
+        tag = tags[0]
+        return {
+            'viewer': viewer,
+            'recipe': fixture_recipe,
+            'author': fixture_author,
+            'tag': tag.id,
+            'tag_slug': tag.slug,
+            'ingredient': ingredient.id,
+            'search': ingredient.name[:2],
+            'recipe_search': recipe_ingredient.name.split()[0],
+            'recipe_ingredients': ','.join(map(str, Ingredient.objects.filter(
+                recipes=fixture_recipe).values_list('id', flat=True)[:3])),
+            'recipe_data': {
+                'ingredients': [{'id': pk, 'amount': 10}
+                                for pk in ingredient_ids[:5]],
+                'tags': [tag.id],
+                'image': PNG_IMAGE,
+                'name': 'Замер',
+                'text': 'Рецепт для замера',
+                'cooking_time': 10,
+            },
+            'avatar_data': {'avatar': PNG_IMAGE},
+            'bulk_recipes_data': {'ids': picked[-20:]},
+            'bulk_authors_data': {'ids': user_ids[-21:-1]},
+        }
+
+    def measure(self, fixtures, options):
+        """
+        Прогоняет эндпоинты и сравнивает замеры с бюджетами.
+        """
+        client = APIClient()
+        client.force_authenticate(fixtures['viewer'])
+        samples = {}
+        for _ in range(options['repeat']):
+            for index, endpoint in enumerate(ENDPOINTS):
+                page_sizes = (options['page_sizes'] if endpoint.paged
+                              else [None])
+                for page_size in page_sizes:
+                    samples.setdefault((index, page_size), []).append(
+                        self.call(client, endpoint, page_size, fixtures))
+
+        results = []
+        for index, endpoint in enumerate(ENDPOINTS):
+            measured = [
+                (page_size, samples[(index, page_size)])
+                for page_size in (options['page_sizes'] if endpoint.paged
+                                  else [None])
+            ]
+            flat = len({runs[-1][0] for _, runs in measured}) == 1
+            for page_size, runs in measured:
+                queries = runs[-1][0]
+                ms_median = statistics.median(run[1] for run in runs)
+                status, reason = self.evaluate(
+                    endpoint, queries, ms_median,
+                    {run[2] for run in runs}, flat)
+                results.append({
+                    'route': endpoint.route,
+                    'method': endpoint.method,
+                    'path': endpoint.path,
+                    'page_size': page_size,
+                    'queries': queries,
+                    'query_budget': endpoint.query_budget,
+                    'ms_median': round(ms_median, 3),
+                    'ms_budget': endpoint.ms_budget,
+                    'status': status,
+                    'reason': reason,
+                })
+        return results
+
+    @staticmethod
+    def evaluate(endpoint, queries, ms_median, statuses, flat):
+        """
+        Сравнивает замер с бюджетом и возвращает (статус, причина).
+        """
+        bad_status = statuses - {endpoint.status}
+        if bad_status:
+            return 'fail', f'код ответа {sorted(bad_status)}'
+        if queries > endpoint.query_budget:
+            reason = 'превышен бюджет запросов'
+        elif not flat:
+            reason = 'число запросов зависит от размера страницы'
+        elif ms_median > endpoint.ms_budget:
+            reason = 'превышен бюджет времени'
+        else:
+            return 'ok', ''
+        if endpoint.route in KNOWN_NOT_FLAT:
+            return 'known', reason
+        return 'fail', reason
+
+    @staticmethod
+    def call(client, endpoint, page_size, fixtures):
+        """
+        Выполняет один запрос и возвращает (запросы, мс, код ответа).
+        """
+        path = endpoint.path.format(**fixtures)
+        if page_size is not None:
+            path += ('&' if '?' in path else '?') + f'limit={page_size}'
+        data = fixtures.get(f'{endpoint.data}_data') if endpoint.data else None
+        method = getattr(client, endpoint.method)
+        # Индекс в памяти догоняет записи один раз на смену поколения в
+        # воркере, а не в каждом запросе, поэтому синхронизируется до замера.
+        recipe_ingredient_index.checked_at = 0
+        recipe_ingredient_index.refresh()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = method(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started) * 1000
+        if endpoint.method == 'post' and endpoint.route == 'recipes-list':
+            fixtures['created'] = response.data.get('id')
+        return len(context), elapsed, response.status_code
@@ -0,0 +1,101 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+
+from api.images import IMAGE_FIELDS, variant_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из media файлы изображений и их вариантов, на которые не '
+        'ссылается ни один объект (mark-and-sweep)'
+    )
+
+    # Каталоги media, которыми управляют поля изображений.
+    DIRECTORIES = ('recipes', 'users', 'variants')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе стольких секунд')
+
+    def handle(self, *args, **options):
+        marked = self.mark()
+        # Свежие файлы могут принадлежать ещё не зафиксированной загрузке
+        # или сборке вариантов, поэтому они не удаляются.
+        cutoff = time.time() - options['min_age']
+        removed = size = 0
+        for name, path in self.files():
+            if name in marked:
+                continue
+            stat = os.stat(path)
+            if stat.st_mtime > cutoff:
+                continue
+            # Ссылка могла появиться уже после разметки, а повторная
+            # загрузка тех же байтов — обновить время изменения файла.
+            if self.referenced(name) or os.stat(path).st_mtime > cutoff:
+                continue
+            removed += 1
+            size += stat.st_size
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                os.unlink(path)
+        if not options['dry_run']:
+            self.remove_empty_directories()
+        verb = 'К удалению' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов: {removed} ({size / 2 ** 20:.1f} МБ), '
+            f'используется: {len(marked)}'))
+
+    @staticmethod
+    def mark():
+        """
+        Собирает имена всех файлов, на которые ссылаются объекты.
+        """
+        marked = set()
+        for model, field in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{field: ''}).exclude(
+                **{f'{field}__isnull': True}
+            ).values_list(field, f'{field}_variants')
+            for name, variants in rows.iterator():
+                marked.add(name)
+                marked.update(variant_files(variants))
+        return marked
+
+    @staticmethod
+    def referenced(name):
+        """
+        Ссылается ли на файл хоть один объект — проверка прямо перед
+        удалением, а не по разметке, снятой в начале.
+        """
+        for model, field in IMAGE_FIELDS:
+            objects = model.objects.alias(
+                variants_text=Cast(f'{field}_variants', TextField()))
+            if objects.filter(
+                Q(**{field: name}) | Q(variants_text__contains=name)
+            ).exists():
+                return True
+        return False
+
+    def files(self):
+        for directory in self.DIRECTORIES:
+            root = default_storage.path(directory)
+            for path, _, filenames in os.walk(root):
+                for filename in filenames:
+                    full_path = os.path.join(path, filename)
+                    name = os.path.relpath(
+                        full_path, default_storage.location)
+                    yield name.replace(os.sep, '/'), full_path
+
+    def remove_empty_directories(self):
+        for directory in self.DIRECTORIES:
+            root = default_storage.path(directory)
+            for path, _, _ in os.walk(root, topdown=False):
+                if path != root and not os.listdir(path):
+                    os.rmdir(path)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Показывает счётчики попаданий в кеш анонимных ответов рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счётчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = stats['hit'] + stats['miss']
+        ratio = stats['hit'] / total * 100 if total else 0
+        self.stdout.write(
+            f"Попаданий: {stats['hit']}, промахов: {stats['miss']}, "
+            f"доля попаданий: {ratio:.1f}%"
+        )
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Счётчики обнулены'))
@@ -0,0 +1,220 @@
+import io
+import os
+import tempfile
+import threading
+from collections import Counter
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api.constants import BULK_CREATED, BULK_DELETED
+from api.management.commands.bench_shopping_list import BENCH_CACHES
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem)
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет параллельные запросы добавления и удаления одной и той '
+        'же связи, в том числе вперемешку одиночные и пакетные, и '
+        'проверяет, что ровно один из них проходит'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Параллельных запросов в каждом раунде')
+        parser.add_argument('--rounds', type=int, default=20,
+                            help='Раундов добавления и удаления')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict['TEST']
+        old_test_name = test_settings.get('NAME')
+        if connection.vendor == 'sqlite':
+            # Общая база в памяти не даёт писать из нескольких потоков,
+            # поэтому на SQLite тестовая база создаётся во временном файле.
+            descriptor, test_settings['NAME'] = tempfile.mkstemp(
+                suffix='.sqlite3')
+            os.close(descriptor)
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                failures = self.run_scenarios(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            teardown_test_environment()
+
+        if failures:
+            for failure in failures[:20]:
+                self.stdout.write(failure)
+            raise CommandError(f'Нарушений: {len(failures)}')
+        self.stdout.write(self.style.SUCCESS(
+            'Каждый раунд завершился одним успешным запросом, '
+            'счётчики и списки покупок согласованы'))
+
+    def run_scenarios(self, options):
+        viewer, author, recipe = self.seed()
+        scenarios = (
+            ('favorite', f'/api/recipes/{recipe.pk}/favorite/',
+             Favorite.objects.filter(user=viewer, recipe=recipe)),
+            ('shopping_cart', f'/api/recipes/{recipe.pk}/shopping_cart/',
+             ShoppingCart.objects.filter(user=viewer, recipe=recipe)),
+            ('subscribe', f'/api/users/{author.pk}/subscribe/',
+             Subscription.objects.filter(user=viewer, author=author)),
+        )
+        failures = []
+        for number in range(options['rounds']):
+            for name, url, links in scenarios:
+                for method, expected, rows in (
+                    ('post', HTTPStatus.CREATED, 1),
+                    ('delete', HTTPStatus.NO_CONTENT, 0),
+                ):
+                    statuses = self.hammer(
+                        viewer, method, [(url, None)], options['threads'])
+                    label = f'раунд {number}, {name} {method.upper()}'
+                    if (statuses[expected] != 1
+                            or statuses[HTTPStatus.BAD_REQUEST]
+                            != options['threads'] - 1):
+                        failures.append(f'{label}: ответы {dict(statuses)}')
+                    if links.count() != rows:
+                        failures.append(
+                            f'{label}: строк {links.count()}, '
+                            f'ожидается {rows}')
+                    failures.extend(self.check_consistency(label, recipe))
+            failures.extend(self.run_bulk_round(
+                number, viewer, recipe, options['threads']))
+        return failures
+
+    def run_bulk_round(self, number, viewer, recipe, threads):
+        """
+        Раунд, где одиночные и пакетные запросы к одной связи идут
+        вперемешку: изменить её должен ровно один из них.
+        """
+        scenarios = (
+            ('favorite', f'/api/recipes/{recipe.pk}/favorite/',
+             '/api/recipes/bulk/favorite/',
+             Favorite.objects.filter(user=viewer, recipe=recipe)),
+            ('shopping_cart', f'/api/recipes/{recipe.pk}/shopping_cart/',
+             '/api/recipes/bulk/shopping_cart/',
+             ShoppingCart.objects.filter(user=viewer, recipe=recipe)),
+        )
+        failures = []
+        for name, url, bulk_url, links in scenarios:
+            requests = [(url, None), (bulk_url, {'ids': [recipe.pk]})]
+            for method, expected, rows in (
+                ('post', (HTTPStatus.CREATED, BULK_CREATED), 1),
+                ('delete', (HTTPStatus.NO_CONTENT, BULK_DELETED), 0),
+            ):
+                statuses = self.hammer(viewer, method, requests, threads)
+                label = f'раунд {number}, {name} bulk {method.upper()}'
+                if (sum(statuses[status] for status in expected) != 1
+                        or statuses[HTTPStatus.INTERNAL_SERVER_ERROR]):
+                    failures.append(f'{label}: ответы {dict(statuses)}')
+                if links.count() != rows:
+                    failures.append(
+                        f'{label}: строк {links.count()}, ожидается {rows}')
+                failures.extend(self.check_consistency(label, recipe))
+        return failures
+
+    @staticmethod
+    def seed():
+        viewer, author = (
+            User.objects.create(
+                email=f'{username}@example.com',
+                username=username,
+                first_name='Нагрузка',
+                last_name=username,
+                password=make_password(None),
+            )
+            for username in ('viewer', 'author')
+        )
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='—', cooking_time=10,
+            image='recipes/stress.png')
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            ingredients = list(Ingredient.objects.order_by('id'))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=5)
+            for ingredient in ingredients
+        )
+        return viewer, author, recipe
+
+    @staticmethod
+    def hammer(user, method, requests, threads):
+        """
+        Отправляет threads запросов одновременно, по кругу из requests —
+        пар (url, тело).
+
+        Для пакетного запроса в статистику попадают статусы каждого id из
+        ответа, для остальных — код ответа.
+        """
+        barrier = threading.Barrier(threads)
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def send(url, data):
+            # Ошибка сервера должна попасть в статистику как 500,
+            # а не оборвать поток исключением.
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                response = getattr(client, method)(url, data, format='json')
+            finally:
+                connections.close_all()
+            if data is not None and response.status_code == HTTPStatus.OK:
+                outcomes = [result['status']
+                            for result in response.json()['results']]
+            else:
+                outcomes = [response.status_code]
+            with lock:
+                statuses.update(outcomes)
+
+        workers = [
+            threading.Thread(target=send,
+                             args=requests[number % len(requests)])
+            for number in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return statuses
+
+    @staticmethod
+    def check_consistency(label, recipe):
+        failures = []
+        recipe.refresh_from_db()
+        for field, links in (
+            ('favorites_count', Favorite.objects.filter(recipe=recipe)),
+            ('in_carts_count', ShoppingCart.objects.filter(recipe=recipe)),
+        ):
+            if getattr(recipe, field) != links.count():
+                failures.append(
+                    f'{label}: {field} = {getattr(recipe, field)}, '
+                    f'связей {links.count()}')
+        try:
+            call_command('rebuild_shopping_lists', check=True,
+                         stdout=io.StringIO())
+        except CommandError as error:
+            failures.append(f'{label}: {error}')
+        if ShoppingListItem.objects.filter(total__lte=0).exists():
+            failures.append(f'{label}: в списке покупок нулевые строки')
+        return failures
@@ -0,0 +1,13 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.settings import APISettings
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """
+    Выбор рендерера без учёта параметра format.
+
+    У выгрузок format задаёт тип файла (txt, csv, pdf), а не рендерер DRF,
+    поэтому рендерер выбирается только по заголовку Accept.
+    """
+
+    settings = APISettings({'URL_FORMAT_OVERRIDE': None})
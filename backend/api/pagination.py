@@ -1,12 +1,283 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from collections.abc import Sequence
 
-from api.constants import PAGE_SIZE
+from django.core.exceptions import ValidationError
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from api.constants import ORDERED_ID_FILTER_LIMIT, PAGE_SIZE
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу сортировки без OFFSET.
+
+    Позиция страницы хранится в непрозрачном курсоре со значениями полей
+    сортировки последней (или первой) записи, поэтому глубина страницы не
+    влияет на стоимость запроса. COUNT выполняется только по запросу.
+    """
+
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        self.fields = [
+            queryset.model._meta.get_field(field.lstrip('-'))
+            for field in self.ordering
+        ]
+        self.attnames = [field.attname for field in self.fields]
+        self.count = None
+        if request.query_params.get(self.count_query_param) in (
+            '1', 'true', 'True'
+        ):
+            self.count = queryset.count()
+
+        position, reverse = self.decode_cursor(request)
+        page = self.fetch(queryset, position, reverse)
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = page
+        return page
+
+    def fetch(self, queryset, position, reverse):
+        """
+        Возвращает до page_size + 1 объектов после позиции в порядке обхода.
+        """
+        queryset = self.after(queryset, self.attnames, position, reverse)
+        return list(queryset[:self.page_size + 1])
+
+    def after(self, queryset, attnames, position, reverse):
+        """
+        Упорядочивает queryset по полям attnames и отрезает всё до позиции.
+        """
+        queryset = queryset.order_by(*(
+            ('-' if field.startswith('-') != reverse else '') + attname
+            for field, attname in zip(self.ordering, attnames)
+        ))
+        if position is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(position, reverse, attnames))
+        return queryset
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.build_link(self.page[0], reverse=True)
+
+    def build_link(self, obj, reverse):
+        position = [
+            self.serialize_value(getattr(obj, attname))
+            for attname in self.attnames
+        ]
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(position, reverse),
+        )
+
+    @staticmethod
+    def encode_cursor(position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Возвращает позицию и направление из курсора запроса.
+
+        Пустой курсор означает первую страницу. Значения позиции
+        приводятся к типам полей сортировки, так что подделанный курсор
+        даёт 404, а не ошибку базы.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position, reverse = payload['p'], bool(payload['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(
+            self.fields
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [self.parse_value(field, value)
+                        for field, value in zip(self.fields, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def parse_value(field, value):
+        """
+        Приводит значение позиции к типу поля; целые вдобавок проверяются
+        на диапазон столбца (SQLite своих границ не сообщает, но драйвер
+        не принимает целые шире 64 бит).
+        """
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError('Пустое значение в курсоре.')
+        column = field.target_field if field.is_relation else field
+        bounds = BaseDatabaseOperations.integer_field_ranges.get(
+            column.get_internal_type())
+        if bounds and not bounds[0] <= value <= bounds[1]:
+            raise ValueError('Значение курсора вне диапазона поля.')
+        return value
+
+    def keyset_filter(self, position, reverse, attnames=None):
+        """
+        Строит условие «строго после позиции» для составного ключа.
+        """
+        condition = Q()
+        equal = {}
+        for field, attname, value in zip(self.ordering,
+                                         attnames or self.attnames,
+                                         position):
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{attname}__{lookup}': value})
+            equal[attname] = value
+        return condition
+
+    @staticmethod
+    def serialize_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+
+class FeedPagination(KeysetPagination):
+    """
+    Keyset-пагинация ленты подписок (api.feed.Feed).
+
+    Из каждого источника ленты берётся page_size + 1 ключей после позиции
+    по его собственному индексу, ключи сливаются, и из базы читаются
+    только рецепты страницы. Все поля сортировки должны идти в одном
+    направлении.
+    """
+
+    ordering = ('-pub_date', '-id')
+
+    def fetch(self, feed, position, reverse):
+        keys = set()
+        for source, fields in feed.sources():
+            attnames = [source.model._meta.get_field(field).attname
+                        for field in fields]
+            keys.update(
+                self.after(source, attnames, position, reverse)
+                .values_list(*attnames)[:self.page_size + 1])
+        descending = self.ordering[0].startswith('-') != reverse
+        ids = [pk for _, pk in sorted(keys, reverse=descending)
+               [:self.page_size + 1]]
+        recipes = feed.recipes.in_bulk(ids)
+        return [recipes[pk] for pk in ids if pk in recipes]
+
+
+class OrderedIdList(Sequence):
+    """
+    Объекты queryset в заданном порядке id — для Paginator.
+
+    Число объектов и порядок берутся из списка id, а из базы читается
+    только текущая страница. Если queryset отфильтрован, список сначала
+    сужается до id, подходящих под фильтры.
+    """
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.source_ids = ids
+        self.filtered_ids = None
+
+    @property
+    def ids(self):
+        if self.filtered_ids is None:
+            ids = self.source_ids
+            if self.queryset.query.where:
+                pks = self.queryset.order_by().values_list('pk', flat=True)
+                if len(ids) <= ORDERED_ID_FILTER_LIMIT:
+                    pks = pks.filter(pk__in=ids)
+                allowed = set(pks)
+                ids = [pk for pk in ids if pk in allowed]
+            self.filtered_ids = ids
+        return self.filtered_ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1 or None][0]
+        ids = self.ids[index]
+        objects = self.queryset.in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
 
 
 class DefaultPagination(PageNumberPagination):
     """
     Класс для кастомизации пагинации.
+
+    Если вьюсет объявляет keyset_ordering, а в запросе передан параметр
+    cursor (для первой страницы — пустой), используется KeysetPagination.
+    Выдача в заданном порядке id (OrderedIdList) всегда листается по
+    номерам страниц.
     """
 
     page_size = PAGE_SIZE
     page_size_query_param = 'limit'
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (getattr(view, 'keyset_ordering', None)
+                and isinstance(queryset, QuerySet)
+                and self.keyset_class.cursor_query_param
+                in request.query_params):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from api.cache import RANKING, bump_generations
+from api.constants import (CART_SCORE_WEIGHT, FAVORITE_SCORE_WEIGHT,
+                           RECIPE_SCORE_BATCH_SIZE, RECIPE_SCORE_BUCKET,
+                           RECIPE_SCORES)
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+RECIPE_ACTIVITY = (
+    (Favorite, FAVORITE_SCORE_WEIGHT),
+    (ShoppingCart, CART_SCORE_WEIGHT),
+)
+
+
+def activity_buckets(model, now, horizon):
+    """
+    Число добавлений рецептов в model по корзинам времени: тройки
+    (рецепт, начало корзины, число) за horizon секунд до now.
+    """
+    return (
+        model.objects.filter(
+            created__gt=now - timedelta(seconds=horizon),
+            created__lte=now,
+        )
+        .annotate(bucket=Trunc('created', RECIPE_SCORE_BUCKET))
+        .order_by().values('recipe', 'bucket')
+        .annotate(events=Count('id'))
+        .values_list('recipe', 'bucket', 'events')
+    )
+
+
+def decayed_scores(now):
+    """
+    Рейтинги рецептов на момент now: {поле: {id рецепта: рейтинг}}.
+
+    Каждое добавление весит FAVORITE_SCORE_WEIGHT или CART_SCORE_WEIGHT
+    и вдвое теряет вес за период полураспада рейтинга. База отдаёт уже
+    сгруппированные по корзинам времени счётчики — один запрос на модель
+    для всех рейтингов, а множители затухания считаются один раз на
+    корзину, а не на каждую запись.
+    """
+    scores = {field: defaultdict(float) for field in RECIPE_SCORES}
+    horizon = max(horizon for _, horizon in RECIPE_SCORES.values())
+    decay = {}
+    for model, weight in RECIPE_ACTIVITY:
+        for recipe, start, events in activity_buckets(
+            model, now, horizon,
+        ).iterator():
+            if start not in decay:
+                age = max((now - start).total_seconds(), 0)
+                decay[start] = [
+                    (field, 0.5 ** (age / half_life))
+                    for field, (half_life, horizon) in RECIPE_SCORES.items()
+                    if age < horizon
+                ]
+            for field, factor in decay[start]:
+                scores[field][recipe] += weight * events * factor
+    return scores
+
+
+def write_scores(fields, rows):
+    """
+    Записывает рейтинги rows — кортежи (значения fields..., id) — одним
+    подготовленным UPDATE на пакет строк.
+
+    bulk_update строит для каждого поля CASE по всем id пакета, и на
+    десятках тысяч рецептов запись занимает больше, чем сам расчёт.
+    """
+    ops = connection.ops
+    assignments = ', '.join(
+        f'{ops.quote_name(Recipe._meta.get_field(field).column)} = %s'
+        for field in fields
+    )
+    sql = (
+        f'UPDATE {ops.quote_name(Recipe._meta.db_table)} '
+        f'SET {assignments} '
+        f'WHERE {ops.quote_name(Recipe._meta.pk.column)} = %s'
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), RECIPE_SCORE_BATCH_SIZE):
+            cursor.executemany(
+                sql, rows[start:start + RECIPE_SCORE_BATCH_SIZE])
+
+
+@transaction.atomic
+def update_recipe_scores(now=None):
+    """
+    Пересчитывает рейтинги рецептов и возвращает число изменённых.
+
+    Перезаписываются только рецепты, у которых рейтинг поменялся:
+    с активностью в пределах глубины истории и обнулившиеся.
+    """
+    now = now or timezone.now()
+    scores = decayed_scores(now)
+    fields = list(RECIPE_SCORES)
+    current = {
+        row[0]: row[1:]
+        for row in Recipe.objects.filter(
+            Q(popularity__gt=0) | Q(trending__gt=0),
+        ).order_by().values_list('pk', *fields)
+    }
+    recipes = set(current).union(*(scores[field] for field in fields))
+    changed = []
+    for pk in sorted(recipes):
+        values = tuple(scores[field].get(pk, 0.0) for field in fields)
+        if values != current.get(pk, (0.0,) * len(fields)):
+            changed.append((*values, pk))
+    write_scores(fields, changed)
+    if changed:
+        bump_generations([RANKING])
+    return len(changed)
@@ -0,0 +1,469 @@
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import chain
+
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from api.cache import (INGREDIENTS, RECIPE_INGREDIENTS, SEARCH,
+                       VersionedSnapshot, bump_generations)
+from api.constants import (INGREDIENT_INDEX_CHECK_INTERVAL,
+                           INGREDIENT_SEARCH_LIMIT,
+                           RECIPE_INGREDIENT_INDEX_CHECK_INTERVAL,
+                           RECIPE_INGREDIENT_INDEX_MAX_CHANGES,
+                           RECIPE_INGREDIENT_INDEX_SYNC_MARGIN,
+                           RECIPE_SEARCH_BATCH_SIZE, RECIPE_SEARCH_CONFIG,
+                           RECIPE_SEARCH_WEIGHTS)
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+RECIPE_ID_MASK = 2 ** 32 - 1
+
+
+class IngredientIndex(VersionedSnapshot):
+    """
+    Индекс ингредиентов в памяти воркера для автодополнения.
+
+    Каталог загружается один раз и хранится отсортированным по названию,
+    так что совпадения по началу строки ищутся бинарным поиском. При смене
+    версии каталога индекс перестраивается.
+    """
+
+    version_key = INGREDIENTS
+    check_interval = INGREDIENT_INDEX_CHECK_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self.keys = []
+        self.rows = []
+        self.by_id = []
+
+    def build(self):
+        by_id = [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for pk, name, unit in Ingredient.objects.order_by('id')
+            .values_list('id', 'name', 'measurement_unit')
+        ]
+        rows = sorted(by_id, key=lambda row: (row['name'].casefold(),
+                                              row['id']))
+        self.keys, self.rows, self.by_id = (
+            [row['name'].casefold() for row in rows], rows, by_id)
+
+    def all(self):
+        self.refresh()
+        return self.by_id
+
+    def search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        """
+        Сначала ингредиенты, начинающиеся с query, затем содержащие его.
+        """
+        self.refresh()
+        query = query.strip().casefold()
+        keys, rows = self.keys, self.rows
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(rows[position])
+            position += 1
+        if len(found) < limit:
+            for key, row in zip(keys, rows):
+                if query in key and not key.startswith(query):
+                    found.append(row)
+                    if len(found) == limit:
+                        break
+        return found
+
+
+ingredient_index = IngredientIndex()
+
+
+def contains(keys, key):
+    position = bisect_left(keys, key)
+    return position < len(keys) and keys[position] == key
+
+
+def discard(keys, key):
+    position = bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
+
+
+class RecipeIngredientIndex(VersionedSnapshot):
+    """
+    Инвертированный индекс «ингредиент → рецепты» в памяти воркера.
+
+    Для каждого ингредиента хранится отсортированный массив ключей
+    рецептов, по 8 байт на связь. Ключ — секунды pub_date в старших 32
+    битах и id в младших, поэтому ключи по убыванию идут в порядке ленты,
+    и результат пересечения не нужно досортировывать по базе.
+
+    Целиком индекс строится только при первом обращении. При смене
+    поколения перечитываются рецепты с недавним updated_at, а удалённые
+    находятся по расхождению с числом рецептов в базе.
+    """
+
+    version_key = RECIPE_INGREDIENTS
+    check_interval = RECIPE_INGREDIENT_INDEX_CHECK_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self.postings = {}
+        self.keys = array('Q')
+        # Недавно перечитанные рецепты: id -> (updated_at, ингредиенты).
+        self.recent = {}
+        self.synced_at = None
+
+    @staticmethod
+    def key(recipe_id, pub_date):
+        return int(pub_date.timestamp()) << 32 | recipe_id
+
+    def build(self):
+        synced_at = timezone.now()
+        last = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        # Секунды pub_date по id рецепта; 0 — рецепта нет. Рецепты,
+        # созданные во время сборки, подхватит следующая синхронизация.
+        seconds = array('Q', bytes(8 * (last + 1)))
+        rows = Recipe.objects.filter(pk__lte=last).order_by().values_list(
+            'pk', 'pub_date')
+        for pk, pub_date in rows.iterator():
+            seconds[pk] = int(pub_date.timestamp())
+        postings = defaultdict(lambda: array('Q'))
+        for ingredient_id, recipe_id in (
+                RecipeIngredient.objects.filter(recipe_id__lte=last)
+                .order_by().values_list('ingredient_id', 'recipe_id')
+                .iterator()):
+            if seconds[recipe_id]:
+                postings[ingredient_id].append(
+                    seconds[recipe_id] << 32 | recipe_id)
+        self.postings = {
+            ingredient_id: array('Q', sorted(keys))
+            for ingredient_id, keys in postings.items()
+        }
+        self.keys = array('Q', sorted(
+            value << 32 | pk for pk, value in enumerate(seconds) if value))
+        self.recent = {}
+        self.synced_at = synced_at
+
+    def update(self):
+        synced_at = timezone.now()
+        since = self.synced_at - timedelta(
+            seconds=RECIPE_INGREDIENT_INDEX_SYNC_MARGIN)
+        changed = list(
+            Recipe.objects.filter(updated_at__gte=since).order_by()
+            .values_list('pk', 'pub_date', 'updated_at')
+            [:RECIPE_INGREDIENT_INDEX_MAX_CHANGES + 1]
+        )
+        if len(changed) > RECIPE_INGREDIENT_INDEX_MAX_CHANGES:
+            self.build()
+            return
+        changed = [row for row in changed
+                   if self.recent.get(row[0], (None,))[0] != row[2]]
+        ingredients = defaultdict(list)
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=[row[0] for row in changed]
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            ingredients[recipe_id].append(ingredient_id)
+        for pk, pub_date, updated_at in changed:
+            key = self.key(pk, pub_date)
+            self.unlink(key, self.recent.get(pk, (None, None))[1])
+            insort(self.keys, key)
+            for ingredient_id in ingredients[pk]:
+                insort(self.postings.setdefault(ingredient_id, array('Q')),
+                       key)
+            self.recent[pk] = (updated_at, tuple(ingredients[pk]))
+        self.recent = {pk: row for pk, row in self.recent.items()
+                       if row[0] >= since}
+
+        total = Recipe.objects.count()
+        if total > len(self.keys):
+            # Рецепты добавлены в обход API (загрузка данных).
+            self.build()
+            return
+        if total < len(self.keys):
+            existing = set(Recipe.objects.values_list('pk', flat=True))
+            for key in [key for key in self.keys
+                        if key & RECIPE_ID_MASK not in existing]:
+                recent = self.recent.pop(key & RECIPE_ID_MASK, (None, None))
+                self.unlink(key, recent[1])
+        self.synced_at = synced_at
+
+    def unlink(self, key, ingredient_ids=None):
+        """
+        Убирает рецепт из индекса.
+
+        Если прежние ингредиенты неизвестны, ключ ищется во всех массивах.
+        """
+        if not contains(self.keys, key):
+            return
+        discard(self.keys, key)
+        if ingredient_ids is None:
+            postings = self.postings.values()
+        else:
+            postings = [self.postings[pk] for pk in ingredient_ids
+                        if pk in self.postings]
+        for keys in postings:
+            discard(keys, key)
+
+    def match(self, ingredient_ids, match='all'):
+        """
+        id рецептов, в которых есть все, хотя бы один, большинство или не
+        меньше match (число) из ингредиентов.
+
+        Сначала идут рецепты с большим числом совпавших ингредиентов, при
+        равенстве — новые.
+        """
+        self.refresh()
+        postings = [self.postings.get(pk, array('Q'))
+                    for pk in ingredient_ids]
+        required = {
+            'all': len(postings),
+            'any': 1,
+            'most': len(postings) // 2 + 1,
+        }.get(match, match)
+        if required >= len(postings):
+            ordered = sorted(self.intersect(postings), reverse=True)
+        else:
+            buckets = defaultdict(list)
+            for key, hits in Counter(chain.from_iterable(postings)).items():
+                if hits >= required:
+                    buckets[hits].append(key)
+            ordered = []
+            for hits in sorted(buckets, reverse=True):
+                ordered += sorted(buckets[hits], reverse=True)
+        return [key & RECIPE_ID_MASK for key in ordered]
+
+    @staticmethod
+    def intersect(postings):
+        """
+        Пересечение от самого короткого массива.
+
+        Если найденных намного меньше, чем ключей в очередном массиве,
+        каждый ищется в нём бинарным поиском, иначе массив пересекается
+        с множеством целиком.
+        """
+        postings = sorted(postings, key=len)
+        found = set(postings[0])
+        for keys in postings[1:]:
+            if not found:
+                break
+            if len(found) * 16 < len(keys):
+                found = {key for key in found if contains(keys, key)}
+            else:
+                found.intersection_update(keys)
+        return found
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+class RecipeSearch:
+    """
+    Полнотекстовый поиск рецептов по названию, ингредиентам и описанию.
+
+    Базовая реализация ищет подстроку через LIKE без ранжирования и ничего
+    не хранит; наследники держат отдельную таблицу-индекс, которая
+    обновляется вместе с рецептом (index) и пересобирается целиком
+    командой rebuild_search_index.
+    """
+
+    table = f'{Recipe._meta.db_table}_search'
+
+    def install(self):
+        """
+        Создаёт таблицу индекса, если её нет (после migrate).
+        """
+
+    def index(self, recipe_ids=None):
+        """
+        Переиндексирует рецепты (все, если recipe_ids не задан).
+        """
+        bump_generations([SEARCH])
+        if recipe_ids is None:
+            self.reindex(None)
+            return
+        recipe_ids = list(recipe_ids)
+        for start in range(0, len(recipe_ids), RECIPE_SEARCH_BATCH_SIZE):
+            self.reindex(recipe_ids[start:start + RECIPE_SEARCH_BATCH_SIZE])
+
+    def reindex(self, recipe_ids):
+        pass
+
+    def remove(self, recipe_ids):
+        pass
+
+    def filter(self, queryset, query):
+        """
+        Оставляет рецепты, подходящие под запрос, лучшие — первыми.
+        """
+        words = self.words(query)
+        if not words:
+            return queryset.none()
+        condition = Q()
+        for word in words:
+            condition &= (
+                Q(name__icontains=word) | Q(text__icontains=word)
+                | Q(pk__in=RecipeIngredient.objects.filter(
+                    ingredient__name__icontains=word).values('recipe_id'))
+            )
+        return queryset.filter(condition)
+
+    @staticmethod
+    def words(query):
+        return re.findall(r'\w+', query.casefold())
+
+    @staticmethod
+    def quote(name):
+        return connection.ops.quote_name(name)
+
+    def source_sql(self, recipe_ids, aggregate):
+        """
+        SELECT id, name, ингредиенты через пробел, text по рецептам.
+        """
+        recipe = self.quote(Recipe._meta.db_table)
+        link = self.quote(RecipeIngredient._meta.db_table)
+        ingredient = self.quote(Ingredient._meta.db_table)
+        where, params = '', []
+        if recipe_ids is not None:
+            where = f'WHERE r.id IN ({", ".join(["%s"] * len(recipe_ids))})'
+            params = list(recipe_ids)
+        return (
+            f'SELECT r.id, r.name, COALESCE({aggregate}, \'\'), r.text '
+            f'FROM {recipe} r '
+            f'LEFT JOIN {link} ri ON ri.recipe_id = r.id '
+            f'LEFT JOIN {ingredient} i ON i.id = ri.ingredient_id '
+            f'{where} GROUP BY r.id, r.name, r.text'
+        ), params
+
+
+class PostgresRecipeSearch(RecipeSearch):
+    """
+    tsvector с русской морфологией в отдельной таблице с GIN-индексом.
+
+    Название, ингредиенты и описание получают веса A, B и C (как
+    RECIPE_SEARCH_WEIGHTS у SQLite), ранг — ts_rank_cd. Запрос разбирается
+    websearch_to_tsquery: работают кавычки, OR и минус.
+    """
+
+    def install(self):
+        table = self.quote(self.table)
+        recipe = self.quote(Recipe._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                f'recipe_id bigint PRIMARY KEY REFERENCES {recipe} (id) '
+                f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS '
+                f'{self.quote(self.table + "_document")} '
+                f'ON {table} USING gin (document)')
+
+    def reindex(self, recipe_ids):
+        source, params = self.source_sql(
+            recipe_ids, "string_agg(i.name, ' ')")
+        weights = ' || '.join(
+            f"setweight(to_tsvector(%s::regconfig, source.{column}), "
+            f"'{weight}')"
+            for column, weight in zip(('name', 'ingredients', 'text'), 'ABC')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.quote(self.table)} (recipe_id, document) '
+                f'SELECT source.id, {weights} '
+                f'FROM ({source}) source (id, name, ingredients, text) '
+                f'ON CONFLICT (recipe_id) '
+                f'DO UPDATE SET document = EXCLUDED.document',
+                [RECIPE_SEARCH_CONFIG] * 3 + params)
+
+    def remove(self, recipe_ids):
+        # Строки индекса удаляются каскадно вместе с рецептом.
+        pass
+
+    def filter(self, queryset, query):
+        if not self.words(query):
+            return queryset.none()
+        table = self.quote(self.table)
+        tsquery = 'websearch_to_tsquery(%s::regconfig, %s)'
+        params = [RECIPE_SEARCH_CONFIG, query]
+        return queryset.extra(
+            select={
+                'search_rank': f'ts_rank_cd({table}.document, {tsquery})',
+            },
+            select_params=params,
+            tables=[self.table],
+            where=[
+                f'{table}.recipe_id = '
+                f'{self.quote(Recipe._meta.db_table)}.id',
+                f'{table}.document @@ {tsquery}',
+            ],
+            params=params,
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+
+class SqliteRecipeSearch(RecipeSearch):
+    """
+    Таблица FTS5, rowid которой совпадает с id рецепта.
+
+    Морфологии для русского в SQLite нет, поэтому каждое слово запроса
+    ищется как префикс; ранг — bm25 с весами колонок.
+    """
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS '
+                f'{self.quote(self.table)} USING fts5('
+                f'name, ingredients, text, '
+                f"tokenize = 'unicode61 remove_diacritics 2')")
+
+    def reindex(self, recipe_ids):
+        source, params = self.source_sql(
+            recipe_ids, "group_concat(i.name, ' ')")
+        table = self.quote(self.table)
+        with connection.cursor() as cursor:
+            if recipe_ids is None:
+                cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {table} '
+                f'(rowid, name, ingredients, text) {source}', params)
+
+    def remove(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.quote(self.table)} WHERE rowid IN '
+                f'({", ".join(["%s"] * len(recipe_ids))})', recipe_ids)
+
+    def filter(self, queryset, query):
+        words = self.words(query)
+        if not words:
+            return queryset.none()
+        table = self.quote(self.table)
+        weights = ', '.join(map(str, RECIPE_SEARCH_WEIGHTS))
+        return queryset.extra(
+            select={'search_rank': f'-bm25({table}, {weights})'},
+            tables=[self.table],
+            where=[
+                f'{table}.rowid = {self.quote(Recipe._meta.db_table)}.id',
+                f'{table} MATCH %s',
+            ],
+            params=[' '.join(f'"{word}"*' for word in words)],
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+
+RECIPE_SEARCH_BACKENDS = {
+    'postgresql': PostgresRecipeSearch(),
+    'sqlite': SqliteRecipeSearch(),
+}
+
+
+def recipe_search():
+    """
+    Поиск рецептов для текущей базы данных.
+    """
+    return RECIPE_SEARCH_BACKENDS.get(connection.vendor, RecipeSearch())
@@ -0,0 +1,20 @@
+from rest_framework import serializers
+
+from api.constants import BULK_MAX_IDS
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """
+    Сериализатор списка id для пакетных операций.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, value):
+        """
+        Убирает повторы, сохраняя порядок.
+        """
+        return list(dict.fromkeys(value))
@@ -1,10 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
-
-from api.constants import MAX_VALUE, MIN_VALUE
-from api.serializers.users import Base64ImageField, UserSerializer
+from rest_framework.settings import api_settings
+
+from api.constants import (INGREDIENT_MATCH_MAX_IDS, INGREDIENT_MATCH_MODES,
+                           MAX_VALUE, MIN_VALUE)
+from api.feed import fan_out, has_large_audience
+from api.images import schedule_variants
+from api.search import recipe_search
+from api.serializers.users import (Base64ImageField,
+                                   RecipeSubscriptionSerializer, SrcsetField,
+                                   UserSerializer, VariantImageField)
+from api.services import (cart_user_ids, insert_link, recipe_amounts,
+                          shift_counter, shift_shopping_lists)
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
 
+User = get_user_model()
+
 
 class TagSerializer(serializers.ModelSerializer):
     """
@@ -65,6 +78,9 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         source='recipe_ingredients',
         read_only=True
     )
+    image = VariantImageField(variant='full', list_variant='card',
+                              read_only=True)
+    image_srcset = SrcsetField(source='image')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -76,6 +92,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'author',
             'ingredients',
             'image',
+            'image_srcset',
             'name',
             'text',
             'cooking_time',
@@ -87,6 +104,9 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         """
         Определяет, является ли рецепт избранным для текущего пользователя.
         """
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -96,11 +116,23 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         """
         Определяет, находится ли рецепт в списке покупок текущего пользователя.
         """
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         user = self.context['request'].user
         if user.is_anonymous:
             return False
         return user.shopping_cart.filter(recipe=obj).exists()
 
+    def to_representation(self, instance):
+        """
+        Передаёт автору аннотацию подписки, посчитанную во вьюсете.
+        """
+        author_is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.is_subscribed = author_is_subscribed
+        return super().to_representation(instance)
+
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
     """
@@ -204,30 +236,50 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             for item in ingredients_data
         ])
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         user = self.context['request'].user
-        recipe = Recipe.objects.create(author=user, **validated_data)
+        recipe = Recipe.objects.create(
+            author=user, fan_out_on_read=has_large_audience(user),
+            **validated_data)
+        shift_counter(User, [user.pk], 'recipes_count', 1)
+        fan_out(recipe)
         recipe.tags.set(tags_data)
         self.create_ingredients(ingredients_data, recipe)
+        recipe_search().index([recipe.pk])
+        schedule_variants(recipe, 'image')
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         tags_data = validated_data.pop('tags', None)
 
+        if 'image' in validated_data:
+            instance.image_variants = {}
         for key, value in validated_data.items():
             setattr(instance, key, value)
         instance.save()
+        if 'image' in validated_data:
+            schedule_variants(instance, 'image')
 
         if tags_data is not None:
             instance.tags.set(tags_data)
 
         if ingredients_data is not None:
+            old_amounts = recipe_amounts([instance.pk])
             instance.recipe_ingredients.all().delete()
             self.create_ingredients(ingredients_data, instance)
+            new_amounts = {item['id'].id: item['amount']
+                           for item in ingredients_data}
+            shift_shopping_lists(cart_user_ids(instance), {
+                pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+                for pk in old_amounts.keys() | new_amounts.keys()
+            })
 
+        recipe_search().index([instance.pk])
         return instance
 
     def to_representation(self, instance):
@@ -240,40 +292,62 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         ).data
 
 
+class SimilarRecipeSerializer(RecipeSubscriptionSerializer):
+    """
+    Краткий рецепт со сходством с исходным (от 0 до 1).
+    """
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSubscriptionSerializer.Meta):
+        fields = RecipeSubscriptionSerializer.Meta.fields + ('score',)
+
+
 class ShoppingCartSerializer(serializers.ModelSerializer):
     """
     Сериализатор для списка покупок.
     """
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = serializers.ImageField(source='recipe.image', read_only=True)
+    image = VariantImageField(source='recipe.image', variant='card',
+                              read_only=True)
+    image_srcset = SrcsetField(source='recipe.image')
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
+    already_exists_message = 'Рецепт уже есть в списке покупок'
+
     class Meta:
         model = ShoppingCart
         fields = (
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time',
         )
 
-    def validate(self, attrs):
+    def create(self, validated_data):
         """
-        Валидация данных списка покупок.
+        Добавляет рецепт одним INSERT с пропуском конфликта.
+
+        Повторное добавление (в том числе из параллельного запроса)
+        отклоняется по уникальному ограничению, без отдельной проверки.
         """
-        recipe = self.context['recipe']
-        user = self.context['request'].user
-        if user.shopping_cart.filter(recipe=recipe).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже есть в списке покупок')
-        return attrs
+        instance = self.Meta.model(**validated_data)
+        if not insert_link(self.Meta.model, user_id=instance.user_id,
+                           recipe_id=instance.recipe_id,
+                           created=instance.created):
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    self.already_exists_message],
+            })
+        return instance
 
 
 class FavoriteSerializer(ShoppingCartSerializer):
     """
     Сериализатор для избранных рецептов.
     """
+    already_exists_message = 'Рецепт уже есть в избранном'
 
     class Meta:
         model = Favorite
@@ -281,16 +355,47 @@ class FavoriteSerializer(ShoppingCartSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time',
         )
 
-    def validate(self, attrs):
-        """
-        Валидация данных избранных рецептов.
-        """
-        recipe = self.context['recipe']
-        user = self.context['request'].user
-        if user.favorite.filter(recipe=recipe).exists():
+
+class IngredientMatchSerializer(serializers.Serializer):
+    """
+    Параметры поиска рецептов по набору ингредиентов.
+
+    ingredients — id через запятую, match — all, any, most или минимальное
+    число совпавших ингредиентов.
+    """
+    ingredients = serializers.CharField()
+    match = serializers.CharField(default=INGREDIENT_MATCH_MODES[0])
+
+    def validate_ingredients(self, value):
+        try:
+            ids = [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            raise serializers.ValidationError(
+                'Укажите id ингредиентов через запятую.')
+        ids = list(dict.fromkeys(ids))
+        if not ids or min(ids) < 1:
+            raise serializers.ValidationError(
+                'Укажите id ингредиентов через запятую.')
+        if len(ids) > INGREDIENT_MATCH_MAX_IDS:
             raise serializers.ValidationError(
-                'Рецепт уже есть в избранном')
+                f'Не больше {INGREDIENT_MATCH_MAX_IDS} ингредиентов.')
+        return ids
+
+    def validate_match(self, value):
+        if value in INGREDIENT_MATCH_MODES:
+            return value
+        if value.isdecimal() and int(value) > 0:
+            return int(value)
+        raise serializers.ValidationError(
+            f'Допустимо {", ".join(INGREDIENT_MATCH_MODES)} или число.')
+
+    def validate(self, attrs):
+        if (isinstance(attrs['match'], int)
+                and attrs['match'] > len(attrs['ingredients'])):
+            raise serializers.ValidationError({
+                'match': 'Больше, чем передано ингредиентов.'})
         return attrs
@@ -1,48 +1,141 @@
 import base64
-import imghdr
+import re
+import tempfile
 import uuid
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
 
+from api.constants import (BASE64_CHUNK_SIZE, IMAGE_MAX_PIXELS, IMAGE_MAX_SIDE,
+                           IMAGE_MAX_UPLOAD_SIZE, IMAGE_UPLOAD_FORMATS)
+from api.images import schedule_variants, srcset, variant_url
+from api.services import insert_link, latest_recipes_by_author
 from recipes.models import Recipe
 from users.models import Subscription
 
 User = get_user_model()
 
 
-class Base64ImageField(serializers.ImageField):
+class VariantImageField(serializers.ImageField):
     """
-    Класс сериализации изображения в base64
+    Ссылка на уменьшенный вариант изображения (JPEG).
+
+    В списке (many=True) берётся list_variant, если он задан. Пока варианты
+    не собраны, отдаётся оригинал.
     """
 
-    def to_internal_value(self, data):
-        if isinstance(data, str):
-            if 'data:' in data and ';base64,' in data:
-                _, data = data.split(';base64,')
-            try:
-                decoded_file = base64.b64decode(data)
-            except (TypeError, ValueError):
-                self.fail('invalid_image')
+    def __init__(self, *args, variant=None, list_variant=None, **kwargs):
+        self.variant = variant
+        self.list_variant = list_variant
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        variant = self.variant
+        if self.list_variant and isinstance(
+                getattr(self.parent, 'parent', None),
+                serializers.ListSerializer):
+            variant = self.list_variant
+        variants = getattr(value.instance, f'{value.field.name}_variants')
+        name = variants.get(variant, {}).get('jpg')
+        if name is None:
+            return super().to_representation(value)
+        return variant_url(name, self.context.get('request'))
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    """
+    srcset вариантов изображения по типам: {'image/webp': ..., ...}.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return {}
+        return srcset(getattr(value.instance, f'{value.field.name}_variants'),
+                      self.context.get('request'))
+
 
-            file_name = str(uuid.uuid4())[:12]
-            file_ext = imghdr.what(None, decoded_file)
-            if file_ext not in ['jpeg', 'jpg', 'png']:
-                self.fail('invalid_image')
-            complete_file_name = f"{file_name}.{file_ext}"
-            return ContentFile(decoded_file, name=complete_file_name)
+class Base64ImageField(VariantImageField):
+    """
+    Класс сериализации изображения в base64 или файлом из multipart.
+
+    base64 декодируется кусками во временный файл, multipart-загрузка уже
+    лежит во временном файле. Pillow читает только заголовок: формат и
+    размеры проверяются до полного декодирования.
+    """
+    default_error_messages = {
+        'too_large': 'Файл изображения больше {max_size} МБ.',
+        'too_many_pixels': (
+            'Изображение больше {max_side} px по стороне или '
+            '{max_pixels} Мп.'),
+    }
 
-        return super().to_internal_value(data)
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            file = self.decode_base64(data)
+        elif isinstance(data, UploadedFile):
+            file = data
+        else:
+            self.fail('invalid')
+        if file.size > IMAGE_MAX_UPLOAD_SIZE:
+            self.fail_too_large()
+        file.name = f'{str(uuid.uuid4())[:12]}.{self.inspect(file)}'
+        return file
+
+    def fail_too_large(self):
+        self.fail('too_large', max_size=IMAGE_MAX_UPLOAD_SIZE // 2 ** 20)
+
+    def decode_base64(self, data):
+        if 'data:' in data and ';base64,' in data:
+            _, data = data.split(';base64,', 1)
+        if re.search(r'\s', data):
+            data = re.sub(r'\s+', '', data)
+        if len(data) // 4 * 3 > IMAGE_MAX_UPLOAD_SIZE:
+            self.fail_too_large()
+        file = File(tempfile.TemporaryFile(), name='upload')
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE], validate=True))
+        except (TypeError, ValueError):
+            file.close()
+            self.fail('invalid_image')
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def inspect(self, file):
+        """
+        Проверяет формат и размеры по заголовку и возвращает расширение.
+        """
+        try:
+            with Image.open(file) as image:
+                image_format, (width, height) = image.format, image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        if image_format not in IMAGE_UPLOAD_FORMATS:
+            self.fail('invalid_image')
+        if (max(width, height) > IMAGE_MAX_SIDE
+                or width * height > IMAGE_MAX_PIXELS):
+            self.fail('too_many_pixels', max_side=IMAGE_MAX_SIDE,
+                      max_pixels=IMAGE_MAX_PIXELS // 10 ** 6)
+        file.seek(0)
+        return image_format.lower()
 
 
 class UserSerializer(serializers.ModelSerializer):
     """
     Класс сериализации пользователя
     """
-    avatar = Base64ImageField(required=False)
+    avatar = Base64ImageField(required=False, variant='thumbnail')
+    avatar_srcset = SrcsetField(source='avatar')
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -56,6 +149,7 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name',
             'is_subscribed',
             'avatar',
+            'avatar_srcset',
         )
         extra_kwargs = {
             'password': {'write_only': True},
@@ -67,6 +161,9 @@ class UserSerializer(serializers.ModelSerializer):
         """
         Определяет, подписан ли текущий пользователь на автора.
         """
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -81,6 +178,7 @@ class UserSerializer(serializers.ModelSerializer):
             if request.method == 'POST':
                 representation.pop('is_subscribed', None)
                 representation.pop('avatar', None)
+                representation.pop('avatar_srcset', None)
             if request.method == 'PUT':
                 return {'avatar': representation.pop('avatar', None)}
 
@@ -103,8 +201,17 @@ class UserSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = User.objects.create_user(**validated_data)
+        schedule_variants(user, 'avatar')
         return user
 
+    def update(self, instance, validated_data):
+        if 'avatar' in validated_data:
+            instance.avatar_variants = {}
+        instance = super().update(instance, validated_data)
+        if 'avatar' in validated_data:
+            schedule_variants(instance, 'avatar')
+        return instance
+
 
 class ChangePasswordSerializer(serializers.Serializer):
     """Сериализатор смены пароля."""
@@ -136,6 +243,8 @@ class RecipeSubscriptionSerializer(serializers.ModelSerializer):
     """
     Класс сериализации рецепта для подписки
     """
+    image = VariantImageField(variant='card', read_only=True)
+    image_srcset = SrcsetField(source='image')
 
     class Meta:
         model = Recipe
@@ -143,6 +252,7 @@ class RecipeSubscriptionSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_srcset',
             'cooking_time',
         )
 
@@ -158,8 +268,10 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
-    avatar = serializers.ImageField(source='author.avatar', read_only=True)
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
+    avatar = VariantImageField(source='author.avatar', variant='thumbnail',
+                               read_only=True)
+    avatar_srcset = SrcsetField(source='author.avatar')
 
     class Meta:
         model = Subscription
@@ -173,6 +285,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'recipes',
             'recipes_count',
             'avatar',
+            'avatar_srcset',
         )
 
     def validate(self, attrs):
@@ -180,23 +293,41 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         author = self.context['author']
         if user == author:
             raise ValidationError('Нельзя подписаться на самого себя')
-        if user.follower.filter(author=author).exists():
-            raise ValidationError(f'Вы уже подписаны на {author}')
         return attrs
 
-    def get_is_subscribed(self, obj):
-        return obj.user.follower.filter(author=obj.author).exists()
+    def create(self, validated_data):
+        """
+        Подписывает одним INSERT с пропуском конфликта.
 
-    def get_recipes(self, obj):
-        request = self.context['request']
-        limit = request.query_params.get('recipes_limit')
+        Повторная подписка отклоняется по уникальному ограничению.
+        """
+        instance = Subscription(**validated_data)
+        if not insert_link(Subscription, user_id=instance.user_id,
+                           author_id=instance.author_id):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Вы уже подписаны на {instance.author}']})
+        return instance
 
-        recipes = obj.author.recipes.all()
-        if limit and limit.isdigit():
-            recipes = recipes[:int(limit)]
+    def get_is_subscribed(self, obj):
+        """
+        Подписка сама по себе означает, что пользователь подписан на автора.
+        """
+        return True
 
-        return RecipeSubscriptionSerializer(recipes,
+    def get_recipes(self, obj):
+        """
+        Берёт рецепты автора из предвыборки вьюсета, если она есть.
+        """
+        recipes = self.context.get('author_recipes')
+        if recipes is None:
+            limit = self.get_recipes_limit(self.context['request'])
+            recipes = latest_recipes_by_author([obj.author_id], limit)
+        return RecipeSubscriptionSerializer(recipes.get(obj.author_id, []),
                                             many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.author.recipes.all().count()
+    @staticmethod
+    def get_recipes_limit(request):
+        limit = request.query_params.get('recipes_limit')
+        if limit and limit.isdigit():
+            return int(limit)
+        return None
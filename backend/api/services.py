@@ -1,34 +1,361 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import (BigIntegerField, Case, ExpressionWrapper, F,
+                              IntegerField, OuterRef, Subquery, Sum, Value,
+                              When, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, RowNumber
 
-from recipes.models import RecipeIngredient
+from api.cache import bump_generations, shopping_list_key
+from api.constants import (BULK_ABSENT, BULK_CREATED, BULK_DELETED,
+                           BULK_EXISTS, BULK_NOT_FOUND,
+                           SHOPPING_LIST_CHUNK_SIZE)
+from recipes.constants import MAX_TAGS
+from recipes.models import (Recipe, RecipeIngredient, ShoppingCart,
+                            ShoppingListItem, Tag)
 
 
-def generate_shopping_cart_txt(user):
+def shift_counter(model, pks, field, delta):
     """
-    Генерирует текстовый файл со списком покупок.
+    Атомарно сдвигает денормализованный счётчик записей pks на delta.
+
+    Счётчик не уходит в минус: если он уже разошёлся с данными, уменьшение
+    пропускается, а расхождение исправит команда reconcile_counters.
     """
-    content = f"Список покупок для: {user.username}\n\n"
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
 
-    ingredients = (
-        RecipeIngredient.objects
-        .filter(recipe__shopping_cart__user=user)
-        .values("ingredient__name", "ingredient__measurement_unit")
-        .annotate(total=Sum("amount"))
-        .order_by("ingredient__name")
+
+def free_tag_bit():
+    """
+    Младший бит маски тегов, не занятый ни одним тегом.
+    """
+    used = set(Tag.objects.exclude(bit=None).values_list('bit', flat=True))
+    for bit in range(MAX_TAGS):
+        if bit not in used:
+            return bit
+    raise ValidationError(f'Тегов не может быть больше {MAX_TAGS}.')
+
+
+def assign_tag_bits():
+    """
+    Раздаёт биты тегам, созданным в обход save (bulk_create).
+    """
+    for tag in Tag.objects.filter(bit=None).order_by('id'):
+        Tag.objects.filter(pk=tag.pk).update(bit=free_tag_bit())
+
+
+def with_any_tag(queryset, mask):
+    """
+    Рецепты, у которых есть хотя бы один тег из маски.
+    """
+    return queryset.alias(
+        tag_hits=F('tags_mask').bitand(mask)).filter(tag_hits__gt=0)
+
+
+def tags_mask_expression():
+    """
+    Маска тегов рецепта по его связям с тегами: сумма 1 << bit.
+
+    Теги у рецепта не повторяются, поэтому сумма степеней двойки равна
+    их побитовому ИЛИ.
+    """
+    return Coalesce(Subquery(
+        Recipe.tags.through.objects.filter(recipe=OuterRef('pk'))
+        .order_by().values('recipe')
+        .annotate(mask=Sum(ExpressionWrapper(
+            Cast(Value(1), BigIntegerField()).bitleftshift(F('tag__bit')),
+            output_field=BigIntegerField(),
+        )))
+        .values('mask')
+    ), Value(0, output_field=BigIntegerField()))
+
+
+def update_tags_masks(recipes):
+    """
+    Пересчитывает маски тегов рецептов одним UPDATE.
+    """
+    return recipes.update(tags_mask=tags_mask_expression())
+
+
+def supports_returning():
+    """
+    Возвращает ли база строки, затронутые INSERT и DELETE (RETURNING).
+
+    PostgreSQL умеет это всегда, SQLite — с версии 3.35.
+    """
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
+
+
+def insert_link(model, **values):
+    """
+    Вставляет строку связи одним INSERT, пропуская конфликт с уникальным
+    ограничением модели.
+
+    Используется INSERT ... ON CONFLICT DO NOTHING (INSERT OR IGNORE на
+    SQLite), поэтому параллельные запросы не падают с IntegrityError.
+    Возвращает True, если строка действительно добавлена.
+    """
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in values]
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)} '
+        f'{ops.quote_name(model._meta.db_table)} ({columns}) '
+        f'VALUES ({placeholders})'
+        f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
     )
+    params = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(fields, values.values())
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
 
-    if not ingredients:
-        content += "Корзина пуста.\n"
+
+def insert_select_sql(model, queryset, columns):
+    """
+    INSERT ... SELECT строк queryset в model с пропуском конфликтов и его
+    параметры, а также сама выборка — кортежи значений columns.
+    """
+    ops = connection.ops
+    aliases = {f'insert_{name}': name for name in columns}
+    rows = queryset.order_by().annotate(**{
+        alias: columns[name] for alias, name in aliases.items()
+    }).values_list(*aliases)
+    select, params = rows.query.sql_with_params()
+    names = ', '.join(
+        ops.quote_name(model._meta.get_field(name).column)
+        for name in aliases.values()
+    )
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)} '
+        f'{ops.quote_name(model._meta.db_table)} ({names}) '
+        f'{select}'
+        f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    )
+    return sql, params, rows
+
+
+def insert_select(model, queryset, **columns):
+    """
+    Вставляет в model строки выборки queryset одним INSERT ... SELECT,
+    пропуская конфликты с уникальными ограничениями модели.
+
+    columns сопоставляют полям model выражения над queryset; строки не
+    проходят через Python. Возвращает число добавленных строк.
+    """
+    sql, params, _ = insert_select_sql(model, queryset, columns)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def insert_select_returning(model, queryset, returning, **columns):
+    """
+    То же, что insert_select, но возвращает значения поля returning у
+    строк, которые добавил именно этот запрос.
+
+    Используется INSERT ... SELECT ... RETURNING; без его поддержки строки
+    выборки вставляются по одной через insert_link, чей rowcount так же
+    точен.
+    """
+    sql, params, rows = insert_select_sql(model, queryset, columns)
+    if not supports_returning():
+        return [
+            values[returning] for values in (
+                dict(zip(columns, row)) for row in rows
+            ) if insert_link(model, **values)
+        ]
+    column = model._meta.get_field(returning).column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{sql} RETURNING {connection.ops.quote_name(column)}', params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(queryset, returning):
+    """
+    Удаляет строки queryset и возвращает значения поля returning у строк,
+    которые удалил именно этот запрос.
+
+    Используется DELETE ... RETURNING; без его поддержки строки сначала
+    блокируются SELECT ... FOR UPDATE, так что параллельный запрос их уже
+    не удалит. Вызывать внутри транзакции.
+    """
+    model = queryset.model
+    if not supports_returning():
+        values = list(queryset.select_for_update().values_list(
+            returning, flat=True))
+        queryset.delete()
+        return values
+    ops = connection.ops
+    select, params = queryset.order_by().values('pk').query.sql_with_params()
+    sql = (
+        f'DELETE FROM {ops.quote_name(model._meta.db_table)} '
+        f'WHERE {ops.quote_name(model._meta.pk.column)} IN ({select}) '
+        f'RETURNING '
+        f'{ops.quote_name(model._meta.get_field(returning).column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def bulk_relation(user, model, target, queryset, ids, add):
+    """
+    Добавляет или удаляет связи пользователя с объектами ids.
+
+    Сначала выполняется запись — один INSERT ... SELECT по объектам
+    queryset или один DELETE, оба с RETURNING, — и изменившимися
+    считаются только связи, которые она вернула: параллельный одиночный
+    или пакетный запрос с теми же id не будет учтён дважды. Запись идёт
+    первой, чтобы транзакция на SQLite сразу брала блокировку на запись,
+    а не падала при её повышении после чтения. Затем одним запросом с IN
+    проверяется, какие объекты существуют. Возвращает результаты по
+    каждому id в порядке запроса и список id, для которых связь
+    изменилась.
+    """
+    objects = queryset.filter(pk__in=ids)
+    if add:
+        columns = {target: F('pk'), 'user': Value(user.pk)}
+        for field in model._meta.concrete_fields:
+            if not field.primary_key and field.name not in columns:
+                columns[field.name] = Value(field.get_default(),
+                                            output_field=field)
+        changed = set(insert_select_returning(
+            model, objects, target, **columns))
     else:
-        for item in ingredients:
-            name = item["ingredient__name"]
-            unit = item["ingredient__measurement_unit"]
-            total = item["total"]
-            content += f"{name} ({unit}) — {total}\n"
-    response = HttpResponse(content, content_type="text/plain")
-    response[
-        "Content-Disposition"
-    ] = f"attachment; filename={user.username}_shopping_cart.txt"
-
-    return response
+        changed = set(delete_returning(
+            model.objects.filter(user=user, **{f'{target}__in': objects}),
+            target,
+        ))
+    found = set(objects.values_list('pk', flat=True))
+    results = []
+    for pk in ids:
+        if pk not in found:
+            status = BULK_NOT_FOUND
+        elif add:
+            status = BULK_CREATED if pk in changed else BULK_EXISTS
+        else:
+            status = BULK_DELETED if pk in changed else BULK_ABSENT
+        results.append({'id': pk, 'status': status})
+    return results, [pk for pk in ids if pk in changed]
+
+
+def latest_recipes_by_author(author_ids, limit=None):
+    """
+    Возвращает последние limit рецептов каждого автора одним запросом.
+
+    Если база поддерживает оконные функции, рецепты нумеруются через
+    ROW_NUMBER() OVER (PARTITION BY author) и отбираются по номеру; иначе
+    используется коррелированный подзапрос с LIMIT для каждого автора.
+    """
+    ordering = ('-pub_date', '-id')
+    recipes = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author_id',
+    ).order_by(*ordering)
+    if limit == 0:
+        return {}
+    if limit is not None and connection.features.supports_over_clause:
+        ranked = Recipe.objects.filter(author_id__in=author_ids).annotate(
+            row_rank=Window(
+                RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            ),
+        ).order_by().values('pk', 'row_rank')
+        sql, params = ranked.query.sql_with_params()
+        rank = connection.ops.quote_name('row_rank')
+        recipes = recipes.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE {rank} <= %s',
+            (*params, limit),
+        ))
+    elif limit is not None:
+        recipes = recipes.filter(pk__in=Subquery(
+            Recipe.objects.filter(author_id=OuterRef('author_id'))
+            .order_by(*ordering).values('pk')[:limit]
+        ))
+    grouped = {}
+    for recipe in recipes:
+        grouped.setdefault(recipe.author_id, []).append(recipe)
+    return grouped
+
+
+def recipe_amounts(recipe_ids):
+    """
+    Возвращает суммарные количества ингредиентов рецептов:
+    {ingredient_id: amount}.
+    """
+    return dict(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .values('ingredient_id').annotate(total=Sum('amount'))
+        .order_by().values_list('ingredient_id', 'total')
+    )
+
+
+def cart_user_ids(recipe):
+    return list(ShoppingCart.objects.filter(recipe=recipe).values_list(
+        'user_id', flat=True))
+
+
+def shift_shopping_lists(user_ids, deltas, sign=1):
+    """
+    Прибавляет deltas ({ingredient_id: delta}), умноженные на sign,
+    к спискам покупок user_ids.
+
+    Недостающие строки создаются с нулём, затем все суммы сдвигаются одним
+    UPDATE ... SET total = total + CASE ..., так что параллельные изменения
+    корзин не теряют друг друга. Обнулившиеся строки удаляются, а версии
+    списков сдвигаются, чтобы сбросить закешированные выгрузки.
+    """
+    deltas = {pk: delta * sign for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=pk)
+         for user_id in user_ids
+         for pk, delta in deltas.items() if delta > 0),
+        ignore_conflicts=True,
+    )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    items.update(total=F('total') + Case(
+        *(When(ingredient_id=pk, then=Value(delta))
+          for pk, delta in deltas.items()),
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+    items.filter(total__lte=0).delete()
+    bump_generations(map(shopping_list_key, user_ids))
+
+
+def shopping_list_batches(user):
+    """
+    Отдаёт строки списка покупок (название, единица, количество) пачками.
+
+    Готовые суммы читаются из ShoppingListItem итератором (на PostgreSQL —
+    серверным курсором) по SHOPPING_LIST_CHUNK_SIZE строк, так что в памяти
+    не держится весь результат запроса.
+    """
+    rows = (
+        ShoppingListItem.objects
+        .filter(user=user)
+        .values_list("ingredient__name", "ingredient__measurement_unit",
+                     "total")
+        .order_by("ingredient__name")
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE):
+        batch.append(row)
+        if len(batch) == SHOPPING_LIST_CHUNK_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,89 @@
+import atexit
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from api.constants import (SHORT_LINK_CACHE_SIZE, SHORT_LINK_FLUSH_CLICKS,
+                           SHORT_LINK_FLUSH_INTERVAL)
+from api.services import shift_counter
+from recipes.models import Recipe
+from recipes.short_codes import decode_short_code
+
+
+class ShortLinkResolver:
+    """
+    Переводит коды коротких ссылок в id рецептов и считает переходы.
+
+    Найденные коды хранятся в LRU-кеше воркера, так что повторный переход
+    по ссылке не обращается к базе. Код не меняется, пока жив рецепт;
+    удалённый рецепт убирается из кеша своего воркера сигналом, а в
+    остальных доживает до вытеснения и ведёт на страницу «не найдено».
+    Переходы копятся в памяти и записываются пачкой: по
+    SHORT_LINK_FLUSH_CLICKS переходов, раз в SHORT_LINK_FLUSH_INTERVAL
+    секунд или при остановке воркера.
+    """
+
+    def __init__(self, size=SHORT_LINK_CACHE_SIZE,
+                 flush_clicks=SHORT_LINK_FLUSH_CLICKS,
+                 flush_interval=SHORT_LINK_FLUSH_INTERVAL):
+        self.size = size
+        self.flush_clicks = flush_clicks
+        self.flush_interval = flush_interval
+        self.codes = OrderedDict()
+        self.clicks = Counter()
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def resolve(self, code):
+        """
+        id рецепта по коду или None, если такого кода не выдавалось.
+        """
+        with self.lock:
+            pk = self.codes.get(code)
+            if pk is not None:
+                self.codes.move_to_end(code)
+                return pk
+        if decode_short_code(code) is None:
+            return None
+        pk = Recipe.objects.filter(short_code=code).values_list(
+            'pk', flat=True).first()
+        if pk is not None:
+            with self.lock:
+                self.codes[code] = pk
+                if len(self.codes) > self.size:
+                    self.codes.popitem(last=False)
+        return pk
+
+    def discard(self, code):
+        with self.lock:
+            self.codes.pop(code, None)
+
+    def click(self, pk):
+        with self.lock:
+            self.clicks[pk] += 1
+            self.pending += 1
+            due = (self.pending >= self.flush_clicks
+                   or time.monotonic() - self.flushed_at
+                   >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Записывает накопленные переходы: по UPDATE на каждое различное
+        число переходов, а не на каждый рецепт.
+        """
+        with self.lock:
+            clicks, self.clicks = self.clicks, Counter()
+            self.pending = 0
+            self.flushed_at = time.monotonic()
+        recipes = defaultdict(list)
+        for pk, count in clicks.items():
+            recipes[count].append(pk)
+        for count, pks in recipes.items():
+            shift_counter(Recipe, pks, 'short_link_clicks', count)
+
+
+short_links = ShortLinkResolver()
+atexit.register(short_links.flush)
@@ -0,0 +1,145 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from api.cache import (CATALOGUE, INGREDIENTS, LIST, RECIPE_EDITS,
+                       RECIPE_INGREDIENTS, SHOPPING_LISTS, author_key,
+                       author_list_key, bump_generations, recipe_key,
+                       tag_list_key)
+from api.search import recipe_search
+from api.services import free_tag_bit, update_tags_masks, with_any_tag
+from api.short_links import short_links
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.short_codes import encode_short_code
+from users.constants import PUBLIC_PROFILE_FIELDS
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    keys = [recipe_key(instance.pk), RECIPE_INGREDIENTS, RECIPE_EDITS]
+    if created:
+        keys += [LIST, author_list_key(instance.author_id)]
+    bump_generations(keys)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    bump_generations([
+        recipe_key(instance.pk),
+        LIST,
+        RECIPE_INGREDIENTS,
+        author_list_key(instance.author_id),
+        *(tag_list_key(slug)
+          for slug in instance.tags.values_list('slug', flat=True)),
+    ])
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_neighbours_orphaned(sender, instance, **kwargs):
+    # Списки соседей, где был удаляемый рецепт, станут короче: они
+    # пересчитаются при следующем запуске build_similar_recipes.
+    Recipe.objects.filter(similar__neighbour=instance).update(
+        similar_at=None)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        recipes = (instance.recipes.values_list('pk', flat=True)
+                   if action == 'pre_clear' else pk_set)
+        keys = [tag_list_key(instance.slug), *map(recipe_key, recipes)]
+    else:
+        tags = (instance.tags.all() if action == 'pre_clear'
+                else Tag.objects.filter(pk__in=pk_set))
+        keys = [
+            recipe_key(instance.pk),
+            *map(tag_list_key, tags.values_list('slug', flat=True)),
+        ]
+    bump_generations(keys)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_mask_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif action == 'post_clear':
+        recipes = with_any_tag(Recipe.objects.all(), 1 << instance.bit)
+    else:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    update_tags_masks(recipes)
+
+
+@receiver(pre_save, sender=Tag)
+def tag_bit_assigned(sender, instance, **kwargs):
+    if instance.bit is None:
+        instance.bit = free_tag_bit()
+
+
+@receiver(post_delete, sender=Tag)
+def tag_bit_released(sender, instance, **kwargs):
+    if instance.bit is not None:
+        update_tags_masks(
+            with_any_tag(Recipe.objects.all(), 1 << instance.bit))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    bump_generations([recipe_key(instance.recipe_id), RECIPE_INGREDIENTS])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_generations([CATALOGUE])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed_from_search(sender, instance, **kwargs):
+    recipe_search().remove([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_short_link_removed(sender, instance, **kwargs):
+    short_links.discard(encode_short_code(instance.pk))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_generations([CATALOGUE, INGREDIENTS, SHOPPING_LISTS])
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    if not created:
+        recipe_search().index(
+            Recipe.objects.filter(ingredients=instance)
+            .values_list('pk', flat=True))
+
+
+@receiver(post_migrate)
+def install_recipe_search(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'recipes' and using == DEFAULT_DB_ALIAS:
+        recipe_search().install()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or PUBLIC_PROFILE_FIELDS & set(update_fields):
+        bump_generations([author_key(instance.pk)])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_generations([author_key(instance.pk), LIST])
@@ -0,0 +1,298 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from api.constants import (SIMILAR_BLOCK_SIZE, SIMILAR_RECIPES_COUNT,
+                           SIMILAR_TAG_WEIGHT, SIMILAR_WRITE_BATCH_SIZE)
+from recipes.constants import MAX_TAGS
+from recipes.models import Recipe, RecipeIngredient, SimilarRecipe
+
+SimilarStats = namedtuple('SimilarStats', 'recipes recomputed merged rows')
+
+# Матрица признаков и параметры расчёта. В пуле процессов заполняются
+# инициализатором каждого воркера, чтобы не передавать их с каждым блоком.
+_context = {}
+
+
+def _init_worker(context):
+    _context.clear()
+    _context.update(context)
+
+
+def _best(indices, scores, ids, count):
+    """
+    Оставляет в каждой строке count кандидатов с наибольшим сходством, при
+    равенстве — более новые рецепты (с большим id).
+    """
+    order = np.lexsort((-ids[indices], -scores), axis=1)[:, :count]
+    return (np.take_along_axis(indices, order, axis=1),
+            np.take_along_axis(scores, order, axis=1))
+
+
+def _top(scores, ids, count):
+    """
+    count лучших столбцов каждой строки плотной матрицы сходства.
+    """
+    count = min(count, scores.shape[1])
+    indices = np.argpartition(scores, -count, axis=1)[:, -count:]
+    return _best(indices, np.take_along_axis(scores, indices, axis=1), ids,
+                 count)
+
+
+def _neighbours(rows):
+    """
+    Считает соседей блока строк rows среди всех рецептов.
+
+    Блок сходства считается как разреженная матрица на плотную: столбцы
+    тегов заполнены у большой доли рецептов, и разреженный результат
+    произведения двух разреженных матриц получился бы почти плотным.
+
+    Возвращает rows, индексы и сходства соседей каждой строки, а если в
+    контексте задан candidates — ещё и для каждого рецепта лучших соседей
+    среди rows: сходство симметрично, так что это тот же блок матрицы.
+    """
+    ids, count = _context['ids'], _context['count']
+    matrix = _context['matrix']
+    scores = (matrix @ matrix[rows].T.toarray()).T
+    scores[np.arange(len(rows)), rows] = 0
+    neighbours, neighbour_scores = _top(scores, ids, count)
+    if not _context['candidates']:
+        return rows, neighbours, neighbour_scores, None
+    candidates, candidate_scores = _top(scores.T, ids[rows], count)
+    return (rows, neighbours, neighbour_scores,
+            (rows[candidates], candidate_scores))
+
+
+def load_recipes():
+    """
+    Читает рецепты и строит разреженную матрицу рецепт × признак.
+
+    Признаки — ингредиенты рецепта (вес 1) и теги из tags_mask (вес
+    SIMILAR_TAG_WEIGHT). Строки нормированы, поэтому произведение двух
+    строк — косинусное сходство рецептов. Возвращает отсортированные id,
+    признак «изменён после прошлого расчёта» и матрицу CSR.
+    """
+    rows = list(Recipe.objects.order_by('id').values_list(
+        'id', 'tags_mask', 'updated_at', 'similar_at'))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    masks = np.array([row[1] for row in rows], dtype=np.int64)
+    stale = np.array([similar_at is None or similar_at < updated_at
+                      for _, _, updated_at, similar_at in rows], dtype=bool)
+
+    links = np.array(
+        list(RecipeIngredient.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id')),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    recipe_rows, known = _positions(ids, links[:, 0])
+    ingredients, columns = np.unique(links[known, 1], return_inverse=True)
+    parts = [(recipe_rows[known], columns, 1.0)]
+    for bit in range(MAX_TAGS):
+        tagged = np.flatnonzero(masks & (1 << bit))
+        if len(tagged):
+            parts.append((tagged, np.full(len(tagged),
+                                          len(ingredients) + bit),
+                          SIMILAR_TAG_WEIGHT))
+    matrix = sparse.csr_matrix(
+        (np.concatenate([np.full(len(part_rows), weight, dtype=np.float32)
+                         for part_rows, _, weight in parts]),
+         (np.concatenate([part_rows for part_rows, _, _ in parts]),
+          np.concatenate([part_columns for _, part_columns, _ in parts]))),
+        shape=(len(ids), len(ingredients) + MAX_TAGS),
+        dtype=np.float32,
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    matrix = sparse.diags((1 / norms).astype(np.float32)) @ matrix
+    return ids, stale, matrix.tocsr()
+
+
+def _positions(ids, values):
+    """
+    Позиции values в отсортированном ids и маска найденных.
+    """
+    positions = np.searchsorted(ids, values)
+    known = positions < len(ids)
+    known[known] = ids[positions[known]] == values[known]
+    return positions, known
+
+
+def _compute(matrix, ids, rows, candidates, workers, block_size):
+    """
+    Прогоняет _neighbours по блокам rows, в пуле процессов или на месте.
+    """
+    context = {
+        'matrix': matrix,
+        'ids': ids,
+        'count': SIMILAR_RECIPES_COUNT,
+        'candidates': candidates,
+    }
+    blocks = [rows[start:start + block_size]
+              for start in range(0, len(rows), block_size)]
+    if not workers:
+        _init_worker(context)
+        yield from map(_neighbours, blocks)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(context,)) as pool:
+        yield from pool.map(_neighbours, blocks)
+
+
+def _flatten(rows, neighbours, scores):
+    """
+    Переводит списки соседей в строки таблицы (рецепт, сосед, место,
+    сходство) без соседей с нулевым сходством.
+    """
+    ranks = np.broadcast_to(np.arange(neighbours.shape[1]), neighbours.shape)
+    recipes = np.broadcast_to(rows[:, None], neighbours.shape)
+    positive = scores > 0
+    return (recipes[positive], neighbours[positive], ranks[positive],
+            scores[positive])
+
+
+def _stored(ids):
+    """
+    Текущая таблица соседей в виде массивов позиций рецептов в ids.
+    """
+    rows = list(SimilarRecipe.objects.order_by().values_list(
+        'recipe_id', 'neighbour_id', 'score'))
+    pairs = np.array([row[:2] for row in rows], dtype=np.int64).reshape(-1, 2)
+    scores = np.array([row[2] for row in rows], dtype=np.float32)
+    recipes, known_recipes = _positions(ids, pairs[:, 0])
+    neighbours, known_neighbours = _positions(ids, pairs[:, 1])
+    known = known_recipes & known_neighbours
+    return recipes[known], neighbours[known], scores[known]
+
+
+def _merge(ids, stored, candidates, skip):
+    """
+    Вливает в сохранённые списки соседей рецептов, кроме skip, лучших
+    кандидатов среди изменённых рецептов.
+
+    Возвращает строки таблицы только для рецептов, чей список изменился:
+    это те, у кого в первые SIMILAR_RECIPES_COUNT попал кандидат.
+    """
+    stored_recipes, stored_neighbours, stored_scores = stored
+    candidate_neighbours, candidate_scores = candidates
+    candidate_recipes = np.broadcast_to(
+        np.arange(len(ids))[:, None], candidate_neighbours.shape)
+    fresh = (candidate_scores > 0) & ~skip[candidate_recipes]
+    kept = ~skip[stored_recipes]
+    recipes = np.concatenate(
+        [stored_recipes[kept], candidate_recipes[fresh]])
+    neighbours = np.concatenate(
+        [stored_neighbours[kept], candidate_neighbours[fresh]])
+    scores = np.concatenate([stored_scores[kept], candidate_scores[fresh]])
+    is_candidate = np.concatenate(
+        [np.zeros(kept.sum(), dtype=bool), np.ones(fresh.sum(), dtype=bool)])
+
+    order = np.lexsort((-ids[neighbours], -scores, recipes))
+    recipes, neighbours, scores, is_candidate = (
+        recipes[order], neighbours[order], scores[order], is_candidate[order])
+    starts = np.flatnonzero(np.r_[True, recipes[1:] != recipes[:-1]])
+    ranks = np.arange(len(recipes)) - np.repeat(
+        starts, np.diff(np.r_[starts, len(recipes)]))
+    top = ranks < SIMILAR_RECIPES_COUNT
+    changed = np.zeros(len(ids), dtype=bool)
+    changed[recipes[top & is_candidate]] = True
+    rewrite = top & changed[recipes]
+    return (recipes[rewrite], neighbours[rewrite], ranks[rewrite],
+            scores[rewrite]), np.flatnonzero(changed)
+
+
+def _recompute(matrix, ids, changed, others, candidates, workers,
+               block_size):
+    """
+    Считает соседей изменённых рецептов changed и рецептов others целиком.
+
+    Возвращает строки таблицы и, с candidates, лучших соседей каждого
+    рецепта среди changed.
+    """
+    parts, best = [], None
+    for rows, with_candidates in ((changed, candidates), (others, False)):
+        for block in _compute(matrix, ids, rows, with_candidates, workers,
+                              block_size):
+            block_rows, neighbours, scores, block_best = block
+            parts.append(_flatten(block_rows, neighbours, scores))
+            if block_best is not None and best is not None:
+                block_best = _best(
+                    np.hstack([best[0], block_best[0]]),
+                    np.hstack([best[1], block_best[1]]),
+                    ids, SIMILAR_RECIPES_COUNT)
+            best = block_best if block_best is not None else best
+    return parts, best
+
+
+@transaction.atomic
+def _write(ids, rows, rewritten, changed, started):
+    """
+    Заменяет списки соседей рецептов rewritten (None — всех) строками rows
+    и отмечает рецепты changed посчитанными на момент started.
+    """
+    recipes, neighbours, ranks, scores = rows
+    if rewritten is None:
+        SimilarRecipe.objects.all().delete()
+    else:
+        for start in range(0, len(rewritten), SIMILAR_WRITE_BATCH_SIZE):
+            SimilarRecipe.objects.filter(recipe_id__in=rewritten[
+                start:start + SIMILAR_WRITE_BATCH_SIZE].tolist()
+            ).delete()
+    for start in range(0, len(recipes), SIMILAR_WRITE_BATCH_SIZE):
+        batch = slice(start, start + SIMILAR_WRITE_BATCH_SIZE)
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe_id=recipe, neighbour_id=neighbour,
+                          rank=rank, score=score)
+            for recipe, neighbour, rank, score in zip(
+                ids[recipes[batch]].tolist(),
+                ids[neighbours[batch]].tolist(),
+                ranks[batch].tolist(), scores[batch].tolist())
+        )
+    for start in range(0, len(changed), SIMILAR_WRITE_BATCH_SIZE):
+        Recipe.objects.filter(pk__in=changed[
+            start:start + SIMILAR_WRITE_BATCH_SIZE].tolist()
+        ).update(similar_at=started)
+
+
+def update_similar_recipes(full=False, workers=0,
+                           block_size=SIMILAR_BLOCK_SIZE):
+    """
+    Пересчитывает таблицу похожих рецептов.
+
+    Изменённые после прошлого расчёта рецепты (similar_at старше
+    updated_at) и рецепты, у которых они были в соседях, пересчитываются
+    целиком. Остальным достаточно сравнить свой список с изменёнными
+    рецептами: их сходство с прочими не поменялось. С full или при первом
+    расчёте пересчитываются все рецепты.
+    """
+    started = timezone.now()
+    ids, stale, matrix = load_recipes()
+    if full:
+        stale[:] = True
+    changed = np.flatnonzero(stale)
+    if not len(changed):
+        return SimilarStats(len(ids), 0, 0, 0)
+    incremental = len(changed) < len(ids)
+
+    recompute_mask = stale.copy()
+    if incremental:
+        stored = _stored(ids)
+        recompute_mask[stored[0][stale[stored[1]]]] = True
+    recompute = np.flatnonzero(recompute_mask)
+
+    parts, best = _recompute(matrix, ids, changed,
+                             recompute[~stale[recompute]], incremental,
+                             workers, block_size)
+    merged = np.array([], dtype=np.int64)
+    if incremental:
+        merged_rows, merged = _merge(ids, stored, best, recompute_mask)
+        parts.append(merged_rows)
+    rows = tuple(np.concatenate([part[index] for part in parts])
+                 for index in range(4))
+    _write(ids, rows,
+           ids[np.concatenate([recompute, merged])] if incremental else None,
+           ids[changed], started)
+    return SimilarStats(len(ids), len(recompute), len(merged), len(rows[0]))
@@ -1,20 +1,56 @@
+import re
 from http import HTTPStatus
 
-from django.shortcuts import get_object_or_404
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, Exists, F, OuterRef, Prefetch, Value
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from shortener import shortener
 
-from api.filters import IngredientSearchFilter, RecipeFilter
+from api.cache import AnonymousCacheMixin
+from api.catalogue import catalogue_snapshot
+from api.conditional import ConditionalGetMixin
+from api.constants import RECIPE_ORDERINGS
+from api.exports import EXPORTS, shopping_list_response
+from api.feed import Feed
+from api.filters import RecipeFilter
+from api.negotiation import ExportContentNegotiation
+from api.pagination import FeedPagination, OrderedIdList
 from api.permissions import IsAuthorOrAdminOrReadOnly
-from api.serializers.recipes import (FavoriteSerializer, IngredientSerializer,
+from api.search import ingredient_index, recipe_ingredient_index
+from api.serializers.bulk import BulkIdsSerializer
+from api.serializers.recipes import (FavoriteSerializer,
+                                     IngredientMatchSerializer,
+                                     IngredientSerializer,
                                      RecipeReadSerializer,
                                      RecipeWriteSerializer,
-                                     ShoppingCartSerializer, TagSerializer)
-from api.services import generate_shopping_cart_txt
-from recipes.models import Ingredient, Recipe, Tag
+                                     ShoppingCartSerializer,
+                                     SimilarRecipeSerializer, TagSerializer)
+from api.services import (bulk_relation, cart_user_ids, recipe_amounts,
+                          shift_counter, shift_shopping_lists)
+from api.short_links import short_links
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    return bool(ACCEPTS_GZIP.search(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')))
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
@@ -35,11 +71,49 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
-    filter_backends = (IngredientSearchFilter,)
-    search_fields = ['^name']
+
+    def list(self, request, *args, **kwargs):
+        """
+        Отдаёт каталог или результаты поиска по параметру name из индекса
+        в памяти, без запроса к базе.
+        """
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
+
+
+class CatalogueView(APIView):
+    """
+    Полный каталог тегов и ингредиентов для кеширования на клиенте.
+
+    Отдаёт заранее сериализованное и сжатое тело с сильным ETag и
+    отвечает 304 на совпадающий If-None-Match.
+    """
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        snapshot = catalogue_snapshot.get()
+        gzipped = accepts_gzip(request)
+        etag = f'"{snapshot.etag}-gz"' if gzipped else f'"{snapshot.etag}"'
+        known = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if {f'"{snapshot.etag}"', f'"{snapshot.etag}-gz"'} & set(known):
+            response = HttpResponseNotModified()
+        elif gzipped:
+            response = HttpResponse(snapshot.gzipped,
+                                    content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(snapshot.body,
+                                    content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet):
     """
     Вьюсет для рецептов.
     """
@@ -49,11 +123,124 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def keyset_ordering(self):
+        """
+        Ключ курсора: поля сортировки из параметра ordering списка.
+        """
+        if self.action == 'list':
+            ordering = self.request.query_params.get('ordering')
+            if ordering in RECIPE_ORDERINGS:
+                return RECIPE_ORDERINGS[ordering]
+        return ('-pub_date', '-id')
+
+    def filter_queryset(self, queryset):
+        """
+        С параметром ingredients список строится по индексу ингредиентов:
+        порядок и число рецептов берутся из индекса, остальные фильтры
+        сужают его.
+        """
+        queryset = super().filter_queryset(queryset)
+        if (self.action != 'list'
+                or 'ingredients' not in self.request.query_params):
+            return queryset
+        return OrderedIdList(queryset, self.ingredient_matches)
+
+    @cached_property
+    def ingredient_matches(self):
+        serializer = IngredientMatchSerializer(
+            data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return recipe_ingredient_index.match(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data['match'],
+        )
+
+    def get_queryset(self):
+        """
+        Собирает оптимизированный для чтения queryset рецептов.
+
+        Автор подтягивается через JOIN, теги и ингредиенты — предвыборкой,
+        а флаги текущего пользователя считаются подзапросами EXISTS, поэтому
+        число запросов не зависит от размера страницы.
+        """
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+
+        queryset = queryset.select_related('author').prefetch_related(
+            *self.prefetch_lookups())
+        user = self.request.user
+        if user.is_anonymous:
+            false = Value(False, output_field=BooleanField())
+            return queryset.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+    @staticmethod
+    def prefetch_lookups():
+        """
+        Предвыборки для чтения рецептов: теги и ингредиенты.
+        """
+        return (
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        shift_shopping_lists(cart_user_ids(instance),
+                             recipe_amounts([instance.pk]), sign=-1)
+        instance.delete()
+        shift_counter(User, [instance.author_id], 'recipes_count', -1)
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    @action(detail=False, permission_classes=(IsAuthenticated,),
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        """
+        Возвращает ленту рецептов авторов, на которых подписан пользователь.
+
+        Листается только по курсору (cursor, limit; count=1 — с числом
+        рецептов).
+        """
+        page = self.paginate_queryset(Feed(request.user, self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, permission_classes=(AllowAny,))
+    def similar(self, request, pk=None):
+        """
+        Возвращает похожие рецепты из таблицы соседей.
+
+        Таблицу заранее заполняет команда build_similar_recipes, так что
+        ответ — один запрос по индексу (recipe, rank).
+        """
+        recipes = Recipe.objects.filter(similar_to__recipe=pk).annotate(
+            score=F('similar_to__score'), rank=F('similar_to__rank'),
+        ).order_by('rank')
+        serializer = SimilarRecipeSerializer(recipes, many=True)
+        if not serializer.data:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(serializer.data)
+
     @action(url_path='get-link', detail=True)
     def get_link(self, request, pk=None):
         """
@@ -73,10 +260,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipe = get_object_or_404(Recipe, pk=pk)
 
         if request.method == 'DELETE':
-            instance = request.user.shopping_cart.filter(recipe=recipe)
-            if not instance:
-                return Response(status=HTTPStatus.BAD_REQUEST)
-            instance.delete()
+            with transaction.atomic():
+                deleted, _ = request.user.shopping_cart.filter(
+                    recipe=recipe).delete()
+                if not deleted:
+                    return Response(status=HTTPStatus.BAD_REQUEST)
+                shift_counter(Recipe, [recipe.pk], 'in_carts_count', -1)
+                shift_shopping_lists([request.user.pk],
+                                     recipe_amounts([recipe.pk]), sign=-1)
             return Response(status=HTTPStatus.NO_CONTENT)
 
         serializer = ShoppingCartSerializer(
@@ -84,16 +275,64 @@ class RecipeViewSet(viewsets.ModelViewSet):
             context={'request': request, 'recipe': recipe},
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, recipe=recipe)
+        with transaction.atomic():
+            serializer.save(user=request.user, recipe=recipe)
+            shift_counter(Recipe, [recipe.pk], 'in_carts_count', 1)
+            shift_shopping_lists([request.user.pk],
+                                 recipe_amounts([recipe.pk]))
 
         return Response(status=HTTPStatus.CREATED, data=serializer.data)
 
-    @action(detail=False, permission_classes=(IsAuthenticated,))
+    @action(detail=False, permission_classes=(IsAuthenticated,),
+            content_negotiation_class=ExportContentNegotiation)
     def download_shopping_cart(self, request):
         """
         Генерирует и возвращает файл со списком покупок.
+
+        Формат задаётся параметром format: txt (по умолчанию), csv или pdf.
+        """
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORTS:
+            return Response(
+                status=HTTPStatus.BAD_REQUEST,
+                data={'format': [
+                    f'Доступные форматы: {", ".join(EXPORTS)}.']})
+        return shopping_list_response(request.user, export_format,
+                                      compress=accepts_gzip(request))
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='bulk/favorite', permission_classes=(IsAuthenticated,))
+    def bulk_favorite(self, request):
+        """
+        Добавляет или удаляет из избранного несколько рецептов сразу.
+        """
+        return self.bulk_response(request, Favorite, 'favorites_count')
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='bulk/shopping_cart',
+            permission_classes=(IsAuthenticated,))
+    def bulk_shopping_cart(self, request):
+        """
+        Добавляет или удаляет из корзины несколько рецептов сразу.
         """
-        return generate_shopping_cart_txt(request.user)
+        return self.bulk_response(request, ShoppingCart, 'in_carts_count')
+
+    @staticmethod
+    def bulk_response(request, model, counter):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = request.method == 'POST'
+        sign = 1 if add else -1
+        with transaction.atomic():
+            results, changed = bulk_relation(
+                request.user, model, 'recipe', Recipe.objects.all(),
+                serializer.validated_data['ids'], add)
+            if changed:
+                shift_counter(Recipe, changed, counter, sign)
+            if changed and model is ShoppingCart:
+                shift_shopping_lists([request.user.pk],
+                                     recipe_amounts(changed), sign=sign)
+        return Response(status=HTTPStatus.OK, data={'results': results})
 
     @action(detail=True, methods=['post', 'delete'])
     def favorite(self, request, pk=None):
@@ -103,10 +342,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipe = get_object_or_404(Recipe, pk=pk)
 
         if request.method == 'DELETE':
-            instance = request.user.favorite.filter(recipe=recipe)
-            if not instance:
-                return Response(status=HTTPStatus.BAD_REQUEST)
-            instance.delete()
+            with transaction.atomic():
+                deleted, _ = request.user.favorite.filter(
+                    recipe=recipe).delete()
+                if not deleted:
+                    return Response(status=HTTPStatus.BAD_REQUEST)
+                shift_counter(Recipe, [recipe.pk], 'favorites_count', -1)
             return Response(status=HTTPStatus.NO_CONTENT)
 
         serializer = FavoriteSerializer(
@@ -114,6 +355,26 @@ class RecipeViewSet(viewsets.ModelViewSet):
             context={'request': request, 'recipe': recipe},
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, recipe=recipe)
+        with transaction.atomic():
+            serializer.save(user=request.user, recipe=recipe)
+            shift_counter(Recipe, [recipe.pk], 'favorites_count', 1)
 
         return Response(status=HTTPStatus.CREATED, data=serializer.data)
+
+
+def short_link_redirect(request, code):
+    """
+    Переход по короткой ссылке на страницу рецепта.
+
+    Коды, выданные до перехода на коды из id, разбирает прежний
+    сокращатель ссылок. Неизвестный, исчерпанный или просроченный код —
+    404.
+    """
+    pk = short_links.resolve(code)
+    if pk is None:
+        try:
+            return redirect(shortener.expand(code))
+        except (KeyError, PermissionError):
+            raise Http404
+    short_links.click(pk)
+    return redirect(f'/recipes/{pk}')
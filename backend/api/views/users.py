@@ -1,15 +1,21 @@
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from api.constants import BULK_SELF
+from api.feed import backfill_feed, trim_feed
 from api.permissions import IsUserOrAdminOrReadOnly
+from api.serializers.bulk import BulkIdsSerializer
 from api.serializers.users import (ChangePasswordSerializer,
                                    SubscriptionSerializer, UserSerializer)
+from api.services import bulk_relation, latest_recipes_by_author
 from users.models import Subscription
 
 User = get_user_model()
@@ -21,6 +27,19 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
     permission_classes = (IsUserOrAdminOrReadOnly,)
+    keyset_ordering = None
+
+    def get_queryset(self):
+        """Аннотирует пользователей флагом подписки текущего пользователя."""
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return queryset.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('pk'))))
 
     @action(detail=False,
             permission_classes=(IsAuthenticated,))
@@ -48,7 +67,11 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response(status=HTTPStatus.OK, data=serializer.data)
 
         if user.avatar:
-            user.avatar.delete()
+            # Файл может быть общим с другими загрузками: его удалит
+            # collect_media, когда на него не останется ссылок.
+            user.avatar = None
+            user.avatar_variants = {}
+            user.save(update_fields=['avatar', 'avatar_variants'])
         return Response(status=HTTPStatus.NO_CONTENT)
 
     @action(methods=['post'],
@@ -78,26 +101,63 @@ class UserViewSet(viewsets.ModelViewSet):
                 context={'request': request, 'author': author},
             )
             if serializer.is_valid(raise_exception=True):
-                serializer.save(author=author, user=user)
+                with transaction.atomic():
+                    serializer.save(author=author, user=user)
+                    backfill_feed(user, [author.pk])
                 return Response(status=HTTPStatus.CREATED,
                                 data=serializer.data)
 
-        if user.follower.filter(author=author).exists():
-            Subscription.objects.get(author=author).delete()
+        with transaction.atomic():
+            deleted, _ = user.follower.filter(author=author).delete()
+            if deleted:
+                trim_feed(user, [author.pk])
+        if deleted:
             return Response(status=HTTPStatus.NO_CONTENT)
 
         return Response(status=HTTPStatus.BAD_REQUEST)
 
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='bulk/subscribe',
+            permission_classes=(IsAuthenticated,))
+    def bulk_subscribe(self, request):
+        """Добавляет или удаляет подписки на несколько авторов сразу."""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        add = request.method == 'POST'
+        with transaction.atomic():
+            results, changed = bulk_relation(
+                request.user, Subscription, 'author',
+                User.objects.exclude(pk=request.user.pk),
+                [pk for pk in ids if pk != request.user.pk],
+                add,
+            )
+            if add:
+                backfill_feed(request.user, changed)
+            else:
+                trim_feed(request.user, changed)
+        if request.user.pk in ids:
+            results.insert(ids.index(request.user.pk),
+                           {'id': request.user.pk, 'status': BULK_SELF})
+        return Response(status=HTTPStatus.OK, data={'results': results})
+
     @action(detail=False,
             permission_classes=(IsAuthenticated,),
-            serializer_class=SubscriptionSerializer, )
+            serializer_class=SubscriptionSerializer,
+            keyset_ordering=('-author', '-id'))
     def subscriptions(self, request):
         """Возвращает список авторов, на которых подписан пользователь."""
-        subs = request.user.follower.all()
+        subs = request.user.follower.select_related('author')
         pages = self.paginate_queryset(subs)
+        author_recipes = latest_recipes_by_author(
+            [subscription.author_id for subscription in pages],
+            SubscriptionSerializer.get_recipes_limit(request),
+        )
         return self.get_paginated_response(
             self.get_serializer(
                 pages,
                 many=True,
-                context={'request': request}
+                context={'request': request,
+                         'author_recipes': author_recipes}
             ).data)
@@ -2,6 +2,7 @@
 
 python manage.py makemigrations
 python manage.py migrate
+python manage.py createcachetable
 python manage.py import_csv
 python manage.py collectstatic --noinput
 
@@ -74,6 +74,15 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': env.str(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': env.str('CACHE_LOCATION', default='django_cache'),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -105,6 +114,21 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы называются по хешу содержимого: одинаковые хранятся один раз.
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+
+# Загрузки сразу пишутся во временный файл, а не собираются в памяти.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Процессов для сборки вариантов изображений; 0 — собирать в запросе.
+IMAGE_VARIANT_WORKERS = env.int('IMAGE_VARIANT_WORKERS', default=2)
+
+SHOPPING_LIST_PDF_FONT = env.str(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
@@ -1,13 +1,15 @@
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 
+from api.views.recipes import short_link_redirect
 from foodgram_backend import settings
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
-    path('s/', include('shortener.urls')),
+    re_path(r'^s/(?P<code>[^/]+)/?$', short_link_redirect,
+            name='short-link'),
 ]
 
 if settings.DEBUG:
@@ -1,5 +1,4 @@
 from django.contrib import admin
-from django.db.models import Count
 
 from .models import Ingredient, Recipe, Tag
 
@@ -24,12 +23,3 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name', 'author')
     list_filter = ('tags',)
     empty_value_display = '-пусто-'
-
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.annotate(fav_count=Count("favorite"))
-
-    def favorites_count(self, obj):
-        return obj.fav_count
-
-    favorites_count.short_description = "В избранном (раз)"
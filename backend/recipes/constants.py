@@ -5,3 +5,10 @@ MAX_MEASUREMENT_UNIT_LENGTH = 64
 MAX_RECIPE_NAME_LENGTH = 256
 MIN_VALUE = 1
 MAX_VALUE = 32_000
+# Тегов не больше, чем значащих битов в BIGINT-маске Recipe.tags_mask.
+MAX_TAGS = 63
+# Код короткой ссылки: id рецепта в base62 и контрольная сумма.
+SHORT_CODE_ALPHABET = (
+    '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+SHORT_CODE_CHECKSUM_LENGTH = 2
+MAX_SHORT_CODE_LENGTH = 16
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.constants import SIMILAR_BLOCK_SIZE
+from api.similar import update_similar_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие рецепты по ингредиентам и тегам: изменённые '
+        'с прошлого запуска или, с --full, все'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все рецепты')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Процессов для расчёта (0 — в текущем)')
+        parser.add_argument('--block-size', type=int,
+                            default=SIMILAR_BLOCK_SIZE,
+                            help='Строк матрицы в блоке')
+
+    def handle(self, *args, **options):
+        stats = update_similar_recipes(
+            full=options['full'],
+            workers=options['workers'],
+            block_size=options['block_size'],
+        )
+        self.stdout.write(
+            f'Рецептов: {stats.recipes}, пересчитано: {stats.recomputed}, '
+            f'обновлено сравнением с изменёнными: {stats.merged}, '
+            f'записано соседей: {stats.rows}')
+        self.stdout.write(self.style.SUCCESS('Похожие рецепты посчитаны'))
@@ -4,6 +4,8 @@ import os
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from api.cache import CATALOGUE, INGREDIENTS, bump_generations
+from api.services import assign_tag_bits
 from recipes.models import Ingredient, Tag
 
 DATA_DIR = os.path.join(settings.BASE_DIR, "data")
@@ -33,6 +35,10 @@ class Command(BaseCommand):
 
         self.import_csv("ingredients.csv")
         self.import_csv("tags.csv")
+        assign_tag_bits()
+        # bulk_create не отправляет сигналы, поэтому версию каталога
+        # для кешей и индекса ингредиентов сдвигаем явно.
+        bump_generations([CATALOGUE, INGREDIENTS])
 
         self.stdout.write(self.style.SUCCESS(
             "Данные из CSV файлов успешно импортированы"))
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F
+
+from api.constants import FEED_FAN_OUT_LIMIT
+from api.services import insert_select
+from recipes.models import FeedEntry, Recipe
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты подписок из подписок и рецептов или, с --check, '
+        'сверяет их с ними'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить и вывести расхождения')
+        parser.add_argument('--user', type=int, nargs='+', dest='users',
+                            help='Ограничиться указанными пользователями')
+
+    def handle(self, *args, **options):
+        subscriptions = Subscription.objects.all()
+        entries = FeedEntry.objects.all()
+        if options['users']:
+            subscriptions = subscriptions.filter(user__in=options['users'])
+            entries = entries.filter(user__in=options['users'])
+
+        if options['check']:
+            self.check(self.expected(subscriptions), entries)
+            return
+        with transaction.atomic():
+            if not options['users']:
+                self.mark_large_audiences()
+            entries.delete()
+            created = insert_select(
+                FeedEntry, self.expected(subscriptions),
+                user=F('user'),
+                recipe=F('author__recipes'),
+                author=F('author'),
+                pub_date=F('author__recipes__pub_date'),
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты подписок пересобраны: {created} записей'))
+
+    @staticmethod
+    def expected(subscriptions):
+        """
+        Записи лент: разосланные рецепты авторов из подписок.
+        """
+        return subscriptions.filter(author__recipes__fan_out_on_read=False)
+
+    def mark_large_audiences(self):
+        """
+        Переводит на чтение напрямую рецепты авторов с большой аудиторией,
+        а остальные — на рассылку по лентам.
+        """
+        large = (
+            Subscription.objects.order_by().values('author')
+            .annotate(followers=Count('id'))
+            .filter(followers__gte=FEED_FAN_OUT_LIMIT)
+            .values('author')
+        )
+        marked = Recipe.objects.filter(
+            fan_out_on_read=False, author__in=large,
+        ).update(fan_out_on_read=True)
+        Recipe.objects.filter(fan_out_on_read=True).exclude(
+            author__in=large).update(fan_out_on_read=False)
+        self.stdout.write(f'recipe.fan_out_on_read: {marked} рецептов')
+
+    def check(self, expected, entries):
+        """
+        Сравнивает ленты с подписками запросом EXCEPT в обе стороны.
+        """
+        expected = expected.order_by().values_list(
+            'user', 'author__recipes', 'author', 'author__recipes__pub_date')
+        actual = entries.order_by().values_list(
+            'user', 'recipe', 'author', 'pub_date')
+        missing = list(expected.difference(actual))
+        extra = list(actual.difference(expected))
+        users = {row[0] for row in missing + extra}
+        for user, recipe, author, _ in missing[:20]:
+            self.stdout.write(
+                f'пользователь {user}: нет рецепта {recipe} автора {author}')
+        if users:
+            raise CommandError(
+                f'Ленты расходятся у {len(users)} пользователей '
+                f'({len(missing)} недостающих, {len(extra)} лишних записей)')
+        self.stdout.write(self.style.SUCCESS('Ленты подписок согласованы'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.search import recipe_search
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс рецептов'
+
+    def handle(self, *args, **options):
+        search = recipe_search()
+        with transaction.atomic():
+            search.install()
+            search.index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс пересобран ({type(search).__name__})'))
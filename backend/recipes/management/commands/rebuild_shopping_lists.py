@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from api.cache import SHOPPING_LISTS, bump_generations
+from recipes.models import RecipeIngredient, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает списки покупок из корзин или, с --check, сверяет '
+        'их с агрегацией по корзинам'
+    )
+
+    batch_size = 5000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить и вывести расхождения')
+        parser.add_argument('--user', type=int, nargs='+', dest='users',
+                            help='Ограничиться указанными пользователями')
+
+    def handle(self, *args, **options):
+        carts = {'recipe__shopping_cart__isnull': False}
+        items = {}
+        if options['users']:
+            carts = {'recipe__shopping_cart__user__in': options['users']}
+            items = {'user__in': options['users']}
+        expected = (
+            RecipeIngredient.objects.filter(**carts)
+            .values_list('recipe__shopping_cart__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        actual = ShoppingListItem.objects.filter(**items)
+
+        if options['check']:
+            self.check(expected, actual.values_list(
+                'user', 'ingredient', 'total').order_by())
+        else:
+            self.rebuild(expected, actual)
+
+    def check(self, expected, actual):
+        """
+        Сравнивает таблицу с агрегацией запросом EXCEPT в обе стороны.
+        """
+        missing = list(expected.difference(actual))
+        extra = list(actual.difference(expected))
+        users = {row[0] for row in missing + extra}
+        for user, ingredient, total in missing[:20]:
+            self.stdout.write(
+                f'пользователь {user}, ингредиент {ingredient}: '
+                f'ожидается {total}')
+        if users:
+            raise CommandError(
+                f'Списки покупок расходятся у {len(users)} пользователей '
+                f'({len(missing)} недостающих, {len(extra)} лишних строк)')
+        self.stdout.write(self.style.SUCCESS('Списки покупок согласованы'))
+
+    def rebuild(self, expected, actual):
+        with transaction.atomic():
+            actual.delete()
+            batch = []
+            created = 0
+            for user, ingredient, total in expected.iterator():
+                batch.append(ShoppingListItem(
+                    user_id=user, ingredient_id=ingredient, total=total))
+                if len(batch) == self.batch_size:
+                    ShoppingListItem.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            ShoppingListItem.objects.bulk_create(batch)
+            created += len(batch)
+            # Готовые выгрузки строились по старым суммам.
+            bump_generations([SHOPPING_LISTS])
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны: {created} строк'))
@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с данными и исправляет их'
+
+    # Модель и поле счётчика, модель и внешний ключ, по которым он считается.
+    COUNTERS = (
+        (Recipe, 'favorites_count', Favorite, 'recipe'),
+        (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, source, foreign_key in self.COUNTERS:
+                actual = Coalesce(Subquery(
+                    source.objects.filter(**{foreign_key: OuterRef('pk')})
+                    .order_by().values(foreign_key)
+                    .annotate(total=Count('pk')).values('total')
+                ), 0)
+                drifted = model.objects.exclude(**{field: actual})
+                if options['dry_run']:
+                    fixed = drifted.count()
+                else:
+                    fixed = drifted.update(**{field: actual})
+                self.stdout.write(
+                    f'{model._meta.model_name}.{field}: '
+                    f'расхождений {fixed}')
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import CATALOGUE, bump_generations
+from api.services import assign_tag_bits, tags_mask_expression
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Раздаёт биты тегам без них и сверяет маски тегов рецептов со '
+        'связями рецептов с тегами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not options['dry_run']:
+                assign_tag_bits()
+                bump_generations([CATALOGUE])
+            drifted = Recipe.objects.exclude(tags_mask=tags_mask_expression())
+            if options['dry_run']:
+                fixed = drifted.count()
+            else:
+                fixed = drifted.update(tags_mask=tags_mask_expression())
+            self.stdout.write(f'recipe.tags_mask: расхождений {fixed}')
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Маски тегов сверены'))
@@ -0,0 +1,381 @@
+import csv
+import io
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+
+RecipeTag = Recipe.tags.through
+
+SEED_PASSWORD = 'seed-password'
+SEED_IMAGE = 'recipes/seed.jpg'
+SEED_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+# Общие данные генерации. В пуле процессов заполняются инициализатором
+# каждого воркера, чтобы не передавать их с каждым чанком.
+_context = {}
+
+
+def _init_worker(context):
+    _context.clear()
+    _context.update(context)
+
+
+def _rng(kind, chunk):
+    """
+    Генератор случайных чисел для чанка.
+
+    Зерно зависит только от --seed, типа данных и номера чанка, поэтому
+    результат не зависит от числа воркеров и порядка их выполнения.
+    """
+    return random.Random(f"{_context['seed']}:{kind}:{chunk}")
+
+
+def _power_law_index(rng, size):
+    """
+    Индекс в диапазоне [0, size) с тяжёлым хвостом: малые индексы
+    выпадают намного чаще больших.
+    """
+    return min(int(size * rng.random() ** _context['alpha']), size - 1)
+
+
+def _sample_popular(rng, population, count, exclude=None):
+    """
+    Выбирает до count различных элементов по степенному закону.
+    """
+    picked = set()
+    attempts = count * 4
+    while len(picked) < count and attempts:
+        attempts -= 1
+        item = population[_power_law_index(rng, len(population))]
+        if item != exclude:
+            picked.add(item)
+    return sorted(picked)
+
+
+def _generate_users(chunk):
+    rng = _rng('users', chunk)
+    first_id = _context['first_user_id']
+    start, stop = _chunk_bounds(chunk, _context['users'])
+    span = _context['days'] * 86400
+    rows = []
+    for index in range(start, stop):
+        pk = first_id + index
+        rows.append((
+            pk,
+            f'seed_user_{pk}@example.com',
+            f'seed_user_{pk}',
+            f'Имя{pk}',
+            f'Фамилия{pk}',
+            _context['password'],
+            _context['role'],
+            True,
+            False,
+            False,
+            _context['epoch'] - timedelta(seconds=rng.randrange(span)),
+        ))
+    return {'users': rows}
+
+
+def _generate_recipes(chunk):
+    rng = _rng('recipes', chunk)
+    first_id = _context['first_recipe_id']
+    start, stop = _chunk_bounds(chunk, _context['recipes'])
+    authors = _context['popular_authors']
+    ingredients = _context['popular_ingredients']
+    tags = _context['tag_ids']
+    span = _context['days'] * 86400
+    recipes, recipe_ingredients, recipe_tags = [], [], []
+    for index in range(start, stop):
+        pk = first_id + index
+        pub_date = _context['epoch'] - timedelta(
+            seconds=rng.randrange(span))
+        recipes.append((
+            pk,
+            authors[_power_law_index(rng, len(authors))],
+            SEED_IMAGE,
+            f'Рецепт {pk}',
+            ' '.join(
+                f'Шаг {step}: перемешайте ингредиенты.'
+                for step in range(1, rng.randint(2, 8))
+            ),
+            rng.randint(5, 240),
+            pub_date,
+            pub_date,
+        ))
+        count = int(rng.triangular(3, 15, 7))
+        for ingredient_id in _sample_popular(rng, ingredients, count):
+            recipe_ingredients.append(
+                (pk, ingredient_id, rng.choice((1, 2, 5, 10, 50, 100, 200)))
+            )
+        for tag_id in rng.sample(tags, min(len(tags), rng.randint(1, 3))):
+            recipe_tags.append((pk, tag_id))
+    return {
+        'recipes': recipes,
+        'recipe_ingredients': recipe_ingredients,
+        'recipe_tags': recipe_tags,
+    }
+
+
+def _generate_activity(chunk):
+    rng = _rng('activity', chunk)
+    first_id = _context['first_user_id']
+    start, stop = _chunk_bounds(chunk, _context['users'])
+    recipes = _context['popular_recipes']
+    authors = _context['popular_authors']
+    span = _context['days'] * 86400
+    favorites, carts, subscriptions = [], [], []
+    for index in range(start, stop):
+        user_id = first_id + index
+        for rows, mean in (
+            (favorites, _context['favorites']),
+            (carts, _context['carts']),
+        ):
+            count = int(rng.expovariate(1 / mean)) if mean else 0
+            for recipe_id in _sample_popular(rng, recipes, count):
+                # Свежей активности больше, чем старой.
+                created = _context['epoch'] - timedelta(
+                    seconds=int(span * rng.random() ** 2))
+                rows.append((user_id, recipe_id, created))
+        mean = _context['subscriptions']
+        count = int(rng.expovariate(1 / mean)) if mean else 0
+        for author_id in _sample_popular(rng, authors, count,
+                                         exclude=user_id):
+            subscriptions.append((user_id, author_id))
+    return {
+        'favorites': favorites,
+        'carts': carts,
+        'subscriptions': subscriptions,
+    }
+
+
+def _chunk_bounds(chunk, total):
+    size = _context['chunk_size']
+    return chunk * size, min((chunk + 1) * size, total)
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует нагрузочный набор данных: пользователей, рецепты, "
+        "избранное, корзины и подписки"
+    )
+    TABLES = {
+        'users': (User, (
+            'id', 'email', 'username', 'first_name', 'last_name',
+            'password', 'role', 'is_active', 'is_staff', 'is_superuser',
+            'date_joined',
+        )),
+        'recipes': (Recipe, (
+            'id', 'author_id', 'image', 'name', 'text', 'cooking_time',
+            'pub_date', 'updated_at',
+        )),
+        'recipe_ingredients': (RecipeIngredient, (
+            'recipe_id', 'ingredient_id', 'amount',
+        )),
+        'recipe_tags': (RecipeTag, ('recipe_id', 'tag_id')),
+        'favorites': (Favorite, ('user_id', 'recipe_id', 'created')),
+        'carts': (ShoppingCart, ('user_id', 'recipe_id', 'created')),
+        'subscriptions': (Subscription, ('user_id', 'author_id')),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes', type=int, default=10000,
+                            help='Количество рецептов')
+        parser.add_argument('--favorites', type=float, default=20,
+                            help='Среднее число избранных у пользователя')
+        parser.add_argument('--carts', type=float, default=5,
+                            help='Среднее число рецептов в корзине')
+        parser.add_argument('--subscriptions', type=float, default=10,
+                            help='Среднее число подписок у пользователя')
+        parser.add_argument('--alpha', type=float, default=3.0,
+                            help='Показатель степенного закона '
+                                 'популярности (больше — круче)')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Период публикаций в днях')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Размер пакета записи')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Число процессов генерации '
+                                 '(0 — в текущем процессе)')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('Нужно минимум 2 пользователя и 1 рецепт')
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            call_command('import_csv', stdout=self.stdout,
+                         stderr=self.stderr)
+
+        context = self.build_context(options)
+        phases = (
+            ('users', _generate_users, options['users']),
+            ('recipes', _generate_recipes, options['recipes']),
+            ('activity', _generate_activity, options['users']),
+        )
+        executor = None
+        if options['workers']:
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=_init_worker,
+                initargs=(context,),
+            )
+        _init_worker(context)
+        try:
+            with transaction.atomic(), self.explicit_pub_date():
+                for name, generate, total in phases:
+                    chunks = range(
+                        (total + context['chunk_size'] - 1)
+                        // context['chunk_size'])
+                    results = (executor.map(generate, chunks) if executor
+                               else map(generate, chunks))
+                    written = {}
+                    for result in results:
+                        for table, rows in result.items():
+                            self.write(table, rows, options['batch_size'])
+                            written[table] = written.get(table, 0) + len(
+                                rows)
+                    for table, count in written.items():
+                        self.stdout.write(f'{table}: {count}')
+                self.reset_sequences()
+                call_command('reconcile_counters', stdout=self.stdout)
+                call_command('reconcile_tag_masks', stdout=self.stdout)
+                call_command('rebuild_shopping_lists', stdout=self.stdout)
+                call_command('rebuild_feeds', stdout=self.stdout)
+                call_command('rebuild_search_index', stdout=self.stdout)
+                call_command('update_recipe_scores', now=context['epoch'],
+                             stdout=self.stdout)
+        finally:
+            if executor:
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
+
+    @staticmethod
+    def build_context(options):
+        """
+        Собирает общие для всех чанков данные генерации.
+        """
+        rng = random.Random(f"{options['seed']}:context")
+        first_user_id = (User.objects.aggregate(pk=Max('id'))['pk'] or 0) + 1
+        first_recipe_id = (
+            Recipe.objects.aggregate(pk=Max('id'))['pk'] or 0) + 1
+        user_ids = list(range(first_user_id,
+                              first_user_id + options['users']))
+        recipe_ids = list(range(first_recipe_id,
+                                first_recipe_id + options['recipes']))
+        ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+        for ids in (user_ids, recipe_ids, ingredient_ids):
+            rng.shuffle(ids)
+        return {
+            'seed': options['seed'],
+            'alpha': options['alpha'],
+            'days': options['days'],
+            'users': options['users'],
+            'recipes': options['recipes'],
+            'favorites': options['favorites'],
+            'carts': options['carts'],
+            'subscriptions': options['subscriptions'],
+            'chunk_size': options['batch_size'],
+            'epoch': SEED_EPOCH,
+            'password': make_password(SEED_PASSWORD, salt='seed'),
+            'role': User.USER,
+            'first_user_id': first_user_id,
+            'first_recipe_id': first_recipe_id,
+            'popular_authors': user_ids,
+            'popular_recipes': recipe_ids,
+            'popular_ingredients': ingredient_ids,
+            'tag_ids': list(Tag.objects.order_by('id').values_list(
+                'id', flat=True)),
+        }
+
+    def write(self, table, rows, batch_size):
+        """
+        Записывает строки: COPY на PostgreSQL, bulk_create на остальных.
+
+        В TABLES перечислены только генерируемые столбцы, остальные поля
+        получают умолчания модели в обоих случаях.
+        """
+        if not rows:
+            return
+        model, fields = self.TABLES[table]
+        if connection.vendor == 'postgresql':
+            self.copy(model, fields, rows)
+            return
+        model.objects.bulk_create(
+            (model(**dict(zip(fields, row))) for row in rows),
+            batch_size=batch_size,
+        )
+
+    @staticmethod
+    def copy(model, fields, rows):
+        """
+        Записывает строки одним COPY во все столбцы модели.
+
+        Django не создаёт умолчаний в базе, поэтому столбцы, которых нет в
+        сгенерированных строках, заполняются умолчаниями полей модели — как
+        это делает bulk_create. Пустые значения NOT NULL столбцов читаются
+        как пустые строки, а не NULL (FORCE_NOT_NULL).
+        """
+        columns = [field for field in model._meta.concrete_fields
+                   if field.attname in fields or not field.primary_key]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            obj = model(**dict(zip(fields, row)))
+            writer.writerow([
+                field.get_prep_value(getattr(obj, field.attname))
+                for field in columns
+            ])
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        names = ', '.join(quote(field.column) for field in columns)
+        not_null = ', '.join(
+            quote(field.column) for field in columns if not field.null)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {quote(model._meta.db_table)} ({names}) '
+                f'FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({not_null}))',
+                buffer,
+            )
+
+    @staticmethod
+    def reset_sequences():
+        """
+        Сдвигает последовательности после вставки с явными id.
+        """
+        models = [User, Recipe]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    @staticmethod
+    @contextmanager
+    def explicit_pub_date():
+        """
+        Отключает auto_now_add у Recipe.pub_date и auto_now у
+        Recipe.updated_at, чтобы bulk_create сохранил сгенерированные даты.
+        """
+        pub_date = Recipe._meta.get_field('pub_date')
+        updated_at = Recipe._meta.get_field('updated_at')
+        pub_date.auto_now_add = updated_at.auto_now = False
+        try:
+            yield
+        finally:
+            pub_date.auto_now_add = updated_at.auto_now = True
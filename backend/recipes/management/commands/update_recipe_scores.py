@@ -0,0 +1,34 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.ranking import update_recipe_scores
+
+
+def moment(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ArgumentTypeError(f'Неверная дата и время: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинги рецептов для сортировок popular и trending '
+        'по добавлениям в избранное и корзину с затуханием по времени'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', type=moment,
+                            help='Момент, на который считаются рейтинги '
+                                 '(ISO 8601, по умолчанию — текущий)')
+
+    def handle(self, *args, **options):
+        changed = update_recipe_scores(options['now'])
+        self.stdout.write(f'recipe.popularity, recipe.trending: '
+                          f'{changed} рецептов')
+        self.stdout.write(self.style.SUCCESS('Рейтинги рецептов пересчитаны'))
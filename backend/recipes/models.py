@@ -1,12 +1,14 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from shortener import shortener
+from django.utils import timezone
 
 from recipes.constants import (MAX_INGREDIENT_NAME_LENGTH,
                                MAX_MEASUREMENT_UNIT_LENGTH,
-                               MAX_RECIPE_NAME_LENGTH, MAX_TAG_NAME_LENGTH,
-                               MAX_TAG_SLUG_LENGTH, MAX_VALUE, MIN_VALUE)
+                               MAX_RECIPE_NAME_LENGTH, MAX_SHORT_CODE_LENGTH,
+                               MAX_TAG_NAME_LENGTH, MAX_TAG_SLUG_LENGTH,
+                               MAX_VALUE, MIN_VALUE)
+from recipes.short_codes import encode_short_code
 
 User = get_user_model()
 
@@ -26,6 +28,12 @@ class Tag(models.Model):
         verbose_name='Слаг',
         help_text='Уникальный идентификатор тега',
     )
+    bit = models.PositiveSmallIntegerField(
+        unique=True,
+        null=True,
+        editable=False,
+        verbose_name='Бит в маске тегов рецепта',
+    )
 
     class Meta:
         verbose_name = 'Тег'
@@ -94,6 +102,12 @@ class Recipe(models.Model):
         upload_to='recipes/',
         verbose_name='Изображение',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Варианты изображения',
+    )
     name = models.CharField(
         max_length=MAX_RECIPE_NAME_LENGTH,
         db_index=True,
@@ -116,22 +130,96 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Маска тегов',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном (раз)',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах (раз)',
+        default=0,
+        editable=False,
+    )
+    popularity = models.FloatField(
+        verbose_name='Популярность',
+        default=0,
+        editable=False,
+        help_text='Добавления в избранное и корзину с затуханием по '
+                  'времени; пересчитывается командой update_recipe_scores',
+    )
+    trending = models.FloatField(
+        verbose_name='Набирает популярность',
+        default=0,
+        editable=False,
+        help_text='То же, что популярность, но с быстрым затуханием',
+    )
+    short_code = models.CharField(
+        verbose_name='Код короткой ссылки',
+        max_length=MAX_SHORT_CODE_LENGTH,
+        unique=True,
+        null=True,
+        editable=False,
+    )
+    short_link_clicks = models.PositiveIntegerField(
+        verbose_name='Переходов по короткой ссылке',
+        default=0,
+        editable=False,
+    )
+    similar_at = models.DateTimeField(
+        verbose_name='Похожие рецепты посчитаны',
+        null=True,
+        editable=False,
+    )
+    fan_out_on_read = models.BooleanField(
+        verbose_name='Читается подписчиками напрямую',
+        default=False,
+        editable=False,
+        help_text='Рецепт автора с большой аудиторией: не разослан по '
+                  'лентам подписчиков, а подмешивается при чтении ленты',
+    )
 
     class Meta:
         default_related_name = 'recipe'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
-
-    def _get_short_url(self):
-        return shortener.create(
-            self.author,
-            f'/recipes/{self.id}',
-        )
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['fan_out_on_read', '-pub_date', '-id'],
+                         name='recipe_fan_out_pub_date_idx'),
+            models.Index(fields=['-popularity', '-id'],
+                         name='recipe_popularity_idx'),
+            models.Index(fields=['-trending', '-id'],
+                         name='recipe_trending_idx'),
+            models.Index(fields=['cooking_time', '-id'],
+                         name='recipe_cooking_time_idx'),
+        ]
 
     def get_short_link(self, request):
+        """
+        Короткая ссылка на рецепт.
+
+        Код вычисляется из id и сохраняется при первом запросе ссылки;
+        дальше ссылка строится без записи в базу.
+        """
+        if self.short_code is None:
+            self.short_code = encode_short_code(self.pk)
+            Recipe.objects.filter(pk=self.pk, short_code=None).update(
+                short_code=self.short_code)
         base_url = request.build_absolute_uri('/').rstrip('/')
-        return f'{base_url}/s/{self._get_short_url()}'
+        return f'{base_url}/s/{self.short_code}'
 
     def __str__(self):
         return self.name
@@ -189,6 +277,11 @@ class ShoppingCart(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        verbose_name='Добавлено',
+        default=timezone.now,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Корзина'
@@ -215,6 +308,11 @@ class Favorite(models.Model):
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        verbose_name='Добавлено',
+        default=timezone.now,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -229,3 +327,121 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.recipe} в избранном {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """
+    Модель строки списка покупок: сумма ингредиента по корзине пользователя.
+
+    Поддерживается инкрементально при изменении корзины и рецептов в ней.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name='Ингредиент'
+    )
+    total = models.IntegerField(
+        verbose_name='Количество',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+        default_related_name = 'shopping_list'
+
+    def __str__(self):
+        return f'{self.ingredient} — {self.total} у {self.user}'
+
+
+class FeedEntry(models.Model):
+    """
+    Модель записи ленты подписок: рецепт автора у подписчика.
+
+    Записи создаются при публикации рецепта (fan-out on write), при
+    подписке и удаляются при отписке. Дата публикации и автор копируются
+    из рецепта, чтобы лента листалась и чистилась по индексам этой таблицы.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author_idx'),
+        ]
+        default_related_name = 'feed'
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    """
+    Модель соседа рецепта: один из самых похожих на него рецептов.
+
+    Таблицу заполняет команда build_similar_recipes, эндпоинт похожих
+    рецептов только читает её.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        verbose_name='Рецепт',
+    )
+    neighbour = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт',
+    )
+    rank = models.PositiveSmallIntegerField(
+        verbose_name='Место',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ['recipe', 'rank']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'rank'],
+                name='unique_similar_recipe_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.neighbour} похож на {self.recipe}'
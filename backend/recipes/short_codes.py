@@ -0,0 +1,46 @@
+import zlib
+
+from recipes.constants import SHORT_CODE_ALPHABET, SHORT_CODE_CHECKSUM_LENGTH
+
+BASE = len(SHORT_CODE_ALPHABET)
+
+
+def _encode(number):
+    digits = []
+    while True:
+        number, digit = divmod(number, BASE)
+        digits.append(SHORT_CODE_ALPHABET[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def _checksum(body):
+    value = zlib.crc32(body.encode()) % BASE ** SHORT_CODE_CHECKSUM_LENGTH
+    return _encode(value).rjust(SHORT_CODE_CHECKSUM_LENGTH,
+                                SHORT_CODE_ALPHABET[0])
+
+
+def encode_short_code(pk):
+    """
+    Код короткой ссылки рецепта: id в base62 и контрольная сумма.
+
+    Код зависит только от id, поэтому у рецепта он всегда один и тот же.
+    """
+    body = _encode(pk)
+    return body + _checksum(body)
+
+
+def decode_short_code(code):
+    """
+    id рецепта из кода или None, если код не сходится с контрольной
+    суммой, — такой код не выдавался, и искать его в базе незачем.
+    """
+    body = code[:-SHORT_CODE_CHECKSUM_LENGTH]
+    if not body or any(char not in SHORT_CODE_ALPHABET for char in code):
+        return None
+    if _checksum(body) != code[-SHORT_CODE_CHECKSUM_LENGTH:]:
+        return None
+    pk = 0
+    for char in body:
+        pk = pk * BASE + SHORT_CODE_ALPHABET.index(char)
+    return pk
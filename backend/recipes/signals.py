@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.constants import PUBLIC_PROFILE_FIELDS
+
+User = get_user_model()
+
+
+def touch_recipes(queryset):
+    """
+    Сдвигает updated_at рецептов, представление которых изменилось.
+    """
+    queryset.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    touch_recipes(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None or PUBLIC_PROFILE_FIELDS & set(update_fields):
+        touch_recipes(Recipe.objects.filter(author=instance))
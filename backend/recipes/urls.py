@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views.recipes import IngredientViewSet, RecipeViewSet, TagViewSet
+from api.views.recipes import (CatalogueView, IngredientViewSet, RecipeViewSet,
+                               TagViewSet)
 
 recipes_router = DefaultRouter()
 recipes_router.register('tags', TagViewSet, basename='tags')
@@ -12,5 +13,6 @@ recipes_router.register('recipes', RecipeViewSet, basename='recipes')
 app_name = 'recipes'
 
 urlpatterns = [
+    path('catalogue/', CatalogueView.as_view(), name='catalogue'),
     path('', include(recipes_router.urls)),
 ]
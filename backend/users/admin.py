@@ -16,6 +16,7 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'role',
+        'recipes_count',
     )
     list_filter = ('username', 'email',)
     list_editable = ('role',)
@@ -1,3 +1,8 @@
 FOR_CHARS_EMAIL = 254
 ROLE_LENGTH = 15
 FOR_CHARS_USER = 150
+
+# Поля профиля, которые выводятся вместе с рецептами автора.
+PUBLIC_PROFILE_FIELDS = frozenset(
+    ('email', 'username', 'first_name', 'last_name', 'avatar')
+)